@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end throughput benchmark of the data acquisition loop
+Runs `daq.run_acquisition`, the loop behind the data acquisition menu, headless against the simulated ZVH8 ("SIM::ZVH8") and the Arduino emulator on a pty ("SIM::UNO"), with readings taken back-to-back.
+Each combination of parameters runs in a fresh process and reports cycles/s, the distribution of the time between readings, the stage timings of the run and the peak RSS of the process
+
+    python benchmarks/bench_daq.py --cycles 10,100,1000 --points 201,401,4001 --ard-latency 0.002,0.02 --format csv,npy [--json results.json]
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import pathlib
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+REPO_DIR = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import src.aux_fns as AUXFN
+import src.conn_arduino as ARDCONN
+import src.conn_rsinstrument as INSTCONN
+import src.daq as DAQ
+import src.instrumentation as INSTR
+import src.rw_data as RWDATA
+
+
+def parse_list(text: str, value_type: type):
+    return [value_type(value) for value in text.split(",") if value.strip() != ""]
+
+
+def get_reading_intervals(file_path: pathlib.Path):
+    """
+    Returns: (`numpy.ndarray`) The seconds between the timestamps of consecutive rows of a results file
+    """
+    timestamps = numpy.fromiter((float(line.split(b",", 1)[0]) for line in RWDATA.iter_raw_rows(file_path)), dtype=numpy.float64)
+    return numpy.diff(timestamps)
+
+
+def run_case(params: dict):
+    """
+    Runs one acquisition with the given parameters in a new results folder under the working directory
+    Returns: (`dict`) The measurements of the run
+    """
+    config_vars = AUXFN.get_default_configuration()
+    config_vars.update(VNA_RESOURCE="SIM::ZVH8", ARDUINO_PORT="SIM::UNO", OUTPUT_FOLDER="results",
+                       VNA_POINTS=params["points"], OUTPUT_FORMAT=params["format"], VNA_TRIGGER_MODE=params["trigger"],
+                       SIM_SWEEP_TIME=params["sweep_time"], SIM_TRANSFER_LATENCY=params["vna_latency"],
+                       SIM_ARD_LATENCY=params["ard_latency"], ARDUINO_BAUD=params["baud"])
+
+    vna_session = INSTCONN.VnaSession(configVars=config_vars)
+    if not vna_session.connect():
+        raise RuntimeError("Unable to connect to the simulated VNA")
+    vna_session.setup()
+    serial_object, ard_conn_is_ready = ARDCONN.establish_connection(configVariables=config_vars)
+    if not ard_conn_is_ready:
+        raise RuntimeError("Unable to connect to the Arduino emulator")
+    line_reader = ARDCONN.start_line_reader(serialObject=serial_object)
+
+    start_time = time.perf_counter()
+    cycle_count, is_complete = DAQ.run_acquisition(vnaSession=vna_session, serialObject=serial_object, configVars=config_vars,
+                                                   cycles=params["cycles"], cyclePeriod=0.0, fileSuffix="bench", lineReader=line_reader)
+    elapsed = time.perf_counter() - start_time
+    line_reader.stop()
+    serial_object.close()
+    vna_session.close()
+
+    results_file_path = next(pathlib.Path("results").glob("*-bench-*.csv"))
+    intervals = get_reading_intervals(results_file_path)
+    with open(INSTR.get_sidecar_path(results_file_path), "r") as file:
+        stage_timings = json.load(file)["spans"]
+
+    return {
+        **params,
+        "completed_cycles": cycle_count,
+        "is_complete": is_complete,
+        "elapsed_s": elapsed,
+        "cycles_per_s": cycle_count / elapsed,
+        "interval_ms": {
+            "mean": float(numpy.mean(intervals)) * 1000 if intervals.size else None,
+            "p50": float(numpy.percentile(intervals, 50)) * 1000 if intervals.size else None,
+            "p95": float(numpy.percentile(intervals, 95)) * 1000 if intervals.size else None,
+            "p99": float(numpy.percentile(intervals, 99)) * 1000 if intervals.size else None,
+            "max": float(numpy.max(intervals)) * 1000 if intervals.size else None
+        },
+        # Kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results_file_bytes": sum(path.stat().st_size for path in pathlib.Path("results").iterdir()),
+        "stages": stage_timings
+    }
+
+
+def run_child(params: dict, output_path: pathlib.Path):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        # The acquisition loop prints every reading
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = run_case(params)
+        os.chdir(REPO_DIR)
+    with open(output_path, "w") as file:
+        json.dump(result, file)
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput of the data acquisition loop against the device stand-ins")
+    parser.add_argument("--cycles", type=str, default="10,100,1000", help="Comma-separated run lengths")
+    parser.add_argument("--points", type=str, default="401", help="Comma-separated VNA sweep point counts")
+    parser.add_argument("--format", type=str, default="csv", help="Comma-separated output formats, csv and/or npy")
+    parser.add_argument("--ard-latency", type=str, default="0.002", help="Comma-separated Arduino response latencies in seconds")
+    parser.add_argument("--vna-latency", type=str, default="0.002", help="Comma-separated VNA message latencies in seconds")
+    parser.add_argument("--baud", type=int, default=115200, help="Baud rate the Arduino emulator paces its responses at")
+    parser.add_argument("--sweep-time", type=float, default=0.25, help="Sweep time of the simulated VNA in seconds")
+    parser.add_argument("--trigger", type=str, default="continuous", choices=["continuous", "single"], help="VNA trigger mode")
+    parser.add_argument("--json", type=pathlib.Path, default=None, help="Also write the results to this JSON file")
+    parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", type=pathlib.Path, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(params=json.loads(args.child), output_path=args.child_output)
+        return
+
+    cases = itertools.product(parse_list(args.points, int), parse_list(args.format, str), parse_list(args.ard_latency, float),
+                              parse_list(args.vna_latency, float), parse_list(args.cycles, int))
+    results = list()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for points, output_format, ard_latency, vna_latency, cycles in cases:
+            params = {"cycles": cycles, "points": points, "format": output_format, "ard_latency": ard_latency,
+                      "vna_latency": vna_latency, "baud": args.baud, "sweep_time": args.sweep_time, "trigger": args.trigger}
+            output_path = pathlib.Path(temp_dir).joinpath(f"case-{len(results)}.json")
+            # A fresh process per case, so that the peak RSS is its own
+            subprocess.run([sys.executable, __file__, "--child", json.dumps(params), "--child-output", str(output_path)],
+                           cwd=REPO_DIR, check=True)
+            with open(output_path, "r") as file:
+                result = json.load(file)
+            results.append(result)
+            intervals = result["interval_ms"]
+            print(f"{points:>5} pts {output_format:<4} ard {ard_latency * 1000:5.1f} ms vna {vna_latency * 1000:5.1f} ms "
+                  f"{cycles:>7} cycles: {result['cycles_per_s']:8.1f} cycles/s, interval p50 {intervals['p50'] or 0:7.2f} ms "
+                  f"p95 {intervals['p95'] or 0:7.2f} ms max {intervals['max'] or 0:7.2f} ms, peak RSS {result['peak_rss_kb'] / 1024:6.1f} MiB")
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump({"python": sys.version.split()[0], "results": results}, file, indent=2)
+        print(f"Results written to {args.json}")
+    return
+
+
+if __name__ == '__main__':
+    main()
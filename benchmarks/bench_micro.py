@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the analysis, results file and plotting hot paths
+Uses the measured 401-point trace in q_factor_tests/main.py, and synthetic traces of 201 to 4001 points resampled from it with a little noise.
+Each benchmark is timed at several batch sizes and reported per call, so that results from different versions can be compared
+
+    python benchmarks/bench_micro.py [--quick] [--only analysis,intersect,...] [--json results.json]
+"""
+import argparse
+import ast
+import contextlib
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import numpy
+
+REPO_DIR = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import src.aux_fns as AUXFN
+import src.calculate as CALC
+import src.plotter as PLOTTER
+import src.rw_data as RWDATA
+
+REFERENCE_TRACE_FILE = REPO_DIR.joinpath("q_factor_tests/main.py")
+# The sweep the reference trace was measured over, in MHz
+SWEEP_START_F = 750
+SWEEP_STOP_F = 1300
+
+TRACE_SIZES = [201, 401, 1001, 2001, 4001]
+BATCH_SIZES = [1, 10, 100]
+PLOT_BATCH_SIZES = [1, 10]
+TARGET_CUTOFF_MAGS = [-10, -6, -3]
+NOISE_DB = 0.02
+SEED = 0
+
+
+def load_reference_trace():
+    """
+    Returns: (`numpy.ndarray`) The trace assigned to `pow` in q_factor_tests/main.py, read without running that script
+    """
+    module = ast.parse(REFERENCE_TRACE_FILE.read_text())
+    for node in module.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "pow" for target in node.targets):
+            return numpy.asarray(ast.literal_eval(node.value), dtype=numpy.float64)
+    raise ValueError(f"No reference trace found in {REFERENCE_TRACE_FILE}")
+
+
+def make_traces(reference_trace: numpy.ndarray, points: int, count: int, rng: numpy.random.Generator):
+    """
+    Returns: (`numpy.ndarray`) `count` traces of `points` points, the reference trace resampled with Gaussian noise
+    """
+    reference_freq = numpy.linspace(SWEEP_START_F, SWEEP_STOP_F, reference_trace.size)
+    trace = numpy.interp(numpy.linspace(SWEEP_START_F, SWEEP_STOP_F, points), reference_freq, reference_trace)
+    return trace + rng.normal(0.0, NOISE_DB, size=(count, points))
+
+
+def make_row(field_names: list, trace: numpy.ndarray, index: int):
+    analysis = CALC.get_trace_analysis(target_cutoff_mags=TARGET_CUTOFF_MAGS, sweep_start_f=SWEEP_START_F,
+                                       sweep_stop_f=SWEEP_STOP_F, trace_data=trace)
+    return {
+        field_names[0]: index * 1.0,
+        field_names[1]: trace.size,
+        field_names[2]: analysis["resonance_freq"],
+        field_names[3]: analysis["resonance_mag"],
+        field_names[4]: "50.1+j-1.2",
+        field_names[5]: trace,
+        field_names[6]: [1000.0, 1000.0],
+        field_names[7]: [2.5, 2.5],
+        field_names[8]: analysis["cutoff_mag"],
+        field_names[9]: analysis["bandwidth"],
+        field_names[10]: analysis["q_factor"],
+        field_names[11]: SWEEP_START_F,
+        field_names[12]: SWEEP_STOP_F
+    }
+
+
+def make_plot_data(row: dict, field_names: list):
+    # As extracted for plotting by plotter.engage_plotter
+    return {"startf": row[field_names[11]], "stopf": row[field_names[12]], "pts": row[field_names[1]],
+            "cutoff": row[field_names[8]], "bw": row[field_names[9]], "qfactor": row[field_names[10]],
+            "mfreq": row[field_names[2]], "mmag": row[field_names[3]], "mimp": row[field_names[4]],
+            "trace": row[field_names[5]]}
+
+
+def time_call(function, repeats: int, minTime: float):
+    """
+    Times `function` with as many calls per repeat as fill `minTime` seconds
+    Returns: (`dict`) The `median_s`, `min_s` and `stdev_s` time per call, and the `calls` per repeat
+    """
+    timer = timeit.Timer(function)
+    calls = 1
+    while timer.timeit(number=calls) < minTime:
+        calls *= 2
+    timings = [timing / calls for timing in timer.repeat(repeat=repeats, number=calls)]
+    return {
+        "median_s": statistics.median(timings),
+        "min_s": min(timings),
+        "stdev_s": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "calls": calls
+    }
+
+
+def bench_analysis(traces: numpy.ndarray):
+    def run():
+        for trace in traces:
+            CALC.get_trace_analysis(target_cutoff_mags=TARGET_CUTOFF_MAGS, sweep_start_f=SWEEP_START_F,
+                                    sweep_stop_f=SWEEP_STOP_F, trace_data=trace)
+    return run
+
+
+def bench_intersect(traces: numpy.ndarray):
+    trace_freq = numpy.linspace(SWEEP_START_F, SWEEP_STOP_F, traces.shape[1])
+    cutoff_trace = numpy.full(traces.shape[1], -3.0)
+
+    def run():
+        for trace in traces:
+            list(CALC.intersect(x=trace_freq, f=trace, g=cutoff_trace))
+    return run
+
+
+def bench_write(rows: list, field_names: list, config_vars: dict):
+    def run():
+        RWDATA.initialise_results_file(config_vars=config_vars, field_names=field_names, timestamp="bench")
+        RWDATA.write_operation(config_vars=config_vars, data=rows, field_names=field_names, timestamp="bench")
+    return run
+
+
+def write_input_file(rows: list, field_names: list, config_vars: dict, timestamp: str):
+    """
+    Writes `rows` to a results file for the read benchmarks
+    Returns: (`pathlib.Path`) The path of the results file
+    """
+    RWDATA.initialise_results_file(config_vars=config_vars, field_names=field_names, timestamp=timestamp)
+    RWDATA.write_operation(config_vars=config_vars, data=rows, field_names=field_names, timestamp=timestamp)
+    return RWDATA.get_results_file_path(config_vars=config_vars, timestamp=timestamp)
+
+
+def bench_read(rows: list, field_names: list, config_vars: dict):
+    file_path = write_input_file(rows, field_names, config_vars, timestamp="bench-read")
+
+    def run():
+        RWDATA.read_operation(file_path=file_path, field_names=field_names)
+    return run
+
+
+def bench_iter_results(rows: list, field_names: list, config_vars: dict):
+    file_path = write_input_file(rows, field_names, config_vars, timestamp="bench-iter")
+
+    def run():
+        for _ in RWDATA.iter_results(file_path=file_path, field_names=field_names):
+            pass
+    return run
+
+
+def bench_plot(plot_data: list):
+    figure = PLOTTER.new_figure()
+
+    def run():
+        for index, data in enumerate(plot_data):
+            PLOTTER.plot_graph(data=data, index=index, figure=figure)
+            figure.canvas.draw()
+    return run
+
+
+BENCHMARKS = ["analysis", "intersect", "write_operation", "read_operation", "iter_results", "plot_graph"]
+
+
+def get_git_revision():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the analysis, results file and plotting hot paths")
+    parser.add_argument("--quick", action="store_true", help="Fewer repeats and shorter timings, for a smoke test")
+    parser.add_argument("--only", type=str, default=",".join(BENCHMARKS), help=f"Comma-separated benchmarks to run, from {BENCHMARKS}")
+    parser.add_argument("--json", type=pathlib.Path, default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.only.split(",")]
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks {unknown}")
+    repeats, min_time = (3, 0.02) if args.quick else (7, 0.2)
+
+    reference_trace = load_reference_trace()
+    rng = numpy.random.default_rng(SEED)
+    config_vars = AUXFN.get_default_configuration()
+    field_names = config_vars["FIELD_NAMES"]
+    results = {
+        "revision": get_git_revision(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "machine": platform.machine(),
+        "reference_trace_points": int(reference_trace.size),
+        "benchmarks": list()
+    }
+
+    # The analysis and plotting functions print as they go
+    with tempfile.TemporaryDirectory() as temp_dir, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # Results files are written relative to the working directory
+        working_dir = os.getcwd()
+        os.chdir(temp_dir)
+        try:
+            for points in TRACE_SIZES:
+                batch_traces = make_traces(reference_trace, points, max(BATCH_SIZES), rng)
+                # The first trace at the measured size is the measured trace itself
+                if points == reference_trace.size:
+                    batch_traces[0] = reference_trace
+                rows = [make_row(field_names, trace, index) for index, trace in enumerate(batch_traces)]
+                for batch_size in BATCH_SIZES:
+                    cases = {
+                        "analysis": lambda: bench_analysis(batch_traces[:batch_size]),
+                        "intersect": lambda: bench_intersect(batch_traces[:batch_size]),
+                        "write_operation": lambda: bench_write(rows[:batch_size], field_names, config_vars),
+                        "read_operation": lambda: bench_read(rows[:batch_size], field_names, config_vars),
+                        "iter_results": lambda: bench_iter_results(rows[:batch_size], field_names, config_vars),
+                    }
+                    if batch_size in PLOT_BATCH_SIZES:
+                        cases["plot_graph"] = lambda: bench_plot([make_plot_data(row, field_names) for row in rows[:batch_size]])
+                    for name, make_case in cases.items():
+                        if name not in selected:
+                            continue
+                        timing = time_call(make_case(), repeats=repeats, minTime=min_time)
+                        result = {"name": name, "points": points, "batch": batch_size,
+                                  "per_item_us": timing["median_s"] / batch_size * 1e6, **timing}
+                        results["benchmarks"].append(result)
+                        print(f"{name:<16} {points:>5} pts x {batch_size:<4} {result['per_item_us']:12.1f} us/item "
+                              f"(min {timing['min_s'] / batch_size * 1e6:.1f})", file=sys.__stdout__)
+        finally:
+            os.chdir(working_dir)
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {args.json}")
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup time benchmark
+Measures, each in a fresh interpreter, the cost of importing main.py (cold start to the menu) and each subsystem on its own, and the time from start to the first sweep read from the simulated VNA.
+The import cost per module comes from `python -X importtime`
+
+    python benchmarks/bench_startup.py [--repeats 5] [--json results.json]
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = pathlib.Path(__file__).resolve().parent.parent
+
+MODULES = ["main", "src.aux_fns", "src.conn_arduino", "src.conn_rsinstrument", "src.calculate", "src.rw_data",
+           "src.daq", "src.plotter", "src.campaign"]
+
+# The number of slowest dependencies reported for each module
+TOP_DEPENDENCIES = 5
+
+TIMED_IMPORT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+FIRST_SWEEP = """
+import time
+start = time.perf_counter()
+import main
+config_vars = main.AUXFN.get_default_configuration()
+config_vars.update(VNA_RESOURCE="SIM::ZVH8", SIM_SWEEP_TIME=0.01)
+vna_session = main.INSTCONN.VnaSession(configVars=config_vars)
+vna_session.connect()
+vna_session.setup()
+vna_data = vna_session.acquire()
+trace_analysis = main.DAQ.TRACECALC.get_trace_analysis(target_cutoff_mags=[-10, -6, -3], sweep_start_f=config_vars["VNA_START_FREQ"],
+                                                       sweep_stop_f=config_vars["VNA_STOP_FREQ"], trace_data=vna_data["trace_data"])
+print(time.perf_counter() - start)
+"""
+
+
+def run_python(code: str, importTime: bool = False):
+    """
+    Runs code in a fresh interpreter from the repository directory
+    Returns: (`float`, `str`) The seconds printed on the last line of the output and the `-X importtime` report
+    """
+    args = [sys.executable] + (["-X", "importtime"] if importTime else []) + ["-c", code]
+    result = subprocess.run(args, cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def parse_import_times(report: str):
+    """
+    Returns: (`dict`) `{name: (depth, cumulative microseconds)}` of every module in an `-X importtime` report, where depth 0 is imported by the timed code itself
+    """
+    import_times = dict()
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two spaces per level after the single space separator
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        import_times[name.strip()] = (depth, int(cumulative))
+    return import_times
+
+
+def measure_module(module: str, repeats: int):
+    timings = [run_python(TIMED_IMPORT.format(module=module))[0] for _ in range(repeats)]
+    _, report = run_python(TIMED_IMPORT.format(module=module), importTime=True)
+    # Only the direct dependencies of the module, so that nested ones are not counted twice
+    direct = {name: cost for name, (depth, cost) in parse_import_times(report).items() if depth == 1}
+    slowest = sorted(direct.items(), key=lambda item: item[1], reverse=True)[:TOP_DEPENDENCIES]
+    return {
+        "median_ms": statistics.median(timings) * 1000,
+        "min_ms": min(timings) * 1000,
+        "slowest_dependencies_ms": {name: cost / 1000 for name, cost in slowest}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the startup time of main.py and the import cost of each subsystem")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters started per measurement")
+    parser.add_argument("--json", type=pathlib.Path, default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {"python": sys.version.split()[0], "repeats": args.repeats, "modules": dict()}
+    for module in MODULES:
+        results["modules"][module] = measure_module(module=module, repeats=args.repeats)
+        print(f"{module:<24} {results['modules'][module]['median_ms']:8.1f} ms  "
+              + ", ".join(f"{name} {cost:.1f}" for name, cost in results["modules"][module]["slowest_dependencies_ms"].items()))
+
+    sweep_timings = [run_python(FIRST_SWEEP)[0] for _ in range(args.repeats)]
+    results["first_sweep_ms"] = statistics.median(sweep_timings) * 1000
+    print(f"{'start to first sweep':<24} {results['first_sweep_ms']:8.1f} ms (simulated VNA)")
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {args.json}")
+    return
+
+
+if __name__ == '__main__':
+    main()
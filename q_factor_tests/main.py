@@ -5,7 +5,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
 from typing import Iterable, Tuple
-import timeit
+import time
 
 pow = [-8.893078804, -8.868774414, -8.938971519, -9.018967628, -9.108658791, -9.207920074, -9.278100014, -9.387408257,
        -9.435790062, -9.503517151, -9.566358566, -9.608409882, -9.690438271, -9.75394249, -9.834890366, -9.937273026,
@@ -61,7 +61,7 @@ pow = [-8.893078804, -8.868774414, -8.938971519, -9.018967628, -9.108658791, -9.
 
 
 def main():
-    start_time = timeit.timeit()
+    start_time = time.perf_counter()
     start_f = 750
     stop_f = 1300
     sweep_range = stop_f - start_f
@@ -156,7 +156,7 @@ def main():
             q_factor = minimum_pt["x"] / bandwidth
 
             print("Bandwidth:", bandwidth, "Q Factor:", q_factor)
-            end_time = timeit.timeit()
+            end_time = time.perf_counter()
             time_elapsed = end_time - start_time
             print("Time elapsed for this iteration:", float(time_elapsed))
 
@@ -6,9 +6,11 @@ Created on Wed May 17 2023
 @author: elviskasonlin
 """
 
+import importlib.util
 import json
 import pathlib
 import os
+import sys
 from typing import Callable
 
 def get_default_configuration():
@@ -22,6 +24,10 @@ def get_default_configuration():
         "VNA_RESOURCE": "TCPIP0::172.16.10.10::INSTR",
         "OUTPUT_FOLDER": r'results',
         "OUTPUT_FILE_NAME": r'logfile',
+        "OUTPUT_FORMAT": "csv",
+        "PLOTTER_WORKERS": 0,
+        "OUTPUT_FLUSH_ROWS": 20,
+        "OUTPUT_FSYNC_INTERVAL": 5.0,
         "CONFIG_FOLDER": r'config',
         "CONFIG_FILE_NAME": r'config',
         "VNA_POINTS": 401,
@@ -29,6 +35,35 @@ def get_default_configuration():
         "VNA_STOP_FREQ": 1250,
         "VNA_CAL_KIT_ID": "FSH-Z28",
         "VNA_STATE_FILE": "CTRL_CAL_STATE.SET",
+        "VNA_TRACE_FORMAT": "REAL32",
+        "VNA_RESET_ON_CONNECT": True,
+        "VNA_RECONNECT_ATTEMPTS": 5,
+        "VNA_RECONNECT_BACKOFF": 0.5,
+        "VNA_RECONNECT_BACKOFF_MAX": 8.0,
+        "VNA_TRIGGER_MODE": "continuous",
+        "VNA_TIMEOUT_MIN": 5000,
+        "VNA_TIMEOUT_SWEEP_FACTOR": 3.0,
+        "VNA_TIMEOUT_MARGIN": 2000,
+        "VNA_MARKER_SEARCH_LEFT_FREQ": 750,
+        "VNA_MARKER_SEARCH_RIGHT_FREQ": 1150,
+        "VNA_COMPUTE_MARKER_IMPEDANCE": False,
+        "DAQ_ALIGN_FSR_TO_SWEEP": True,
+        "STATS_SUMMARY_EVERY": 10,
+        "DRIFT_WARMUP_READINGS": 20,
+        "DRIFT_CUSUM_K": 0.5,
+        "DRIFT_CUSUM_H": 5.0,
+        "DRIFT_EWMA_ALPHA": 0.2,
+        "DRIFT_MIN_SIGMA": 0.01,
+        "LIVE_VIEW_ENABLED": False,
+        "LIVE_VIEW_QUEUE_SIZE": 2,
+        "INSTRUMENTATION_ENABLED": True,
+        "INSTRUMENTATION_CAPTURE": "none",
+        "SIM_SWEEP_TIME": 0.25,
+        "SIM_TRANSFER_LATENCY": 0.002,
+        "SIM_TRANSFER_RATE": 5e6,
+        "SIM_SEED": 0,
+        "SIM_ARD_LATENCY": 0.002,
+        "SIM_ARD_NOISE": 2.0,
         "FIELD_NAMES": ["Timestamp / HH:MM:SS.SS", "Sweep points / #", "Freq / Hz", "Mag. / dB", "Impedence / Ohm", "Trace Data", "FSR Resistance / Ohm", "FSR Voltage / V", "Cutoff Mag / dB", "Bandwidth / MHz", "Q Factor at Cutoff Mag", "Start freq / MHz", "Stop freq / MHz"]
     }
     return CONFIGURATION_VARS
@@ -99,6 +134,42 @@ def load_configuration(currentWorkingDir: pathlib.Path, fileName: str, directory
 
     return data_as_dict
 
+def fill_missing_configuration(configVars: dict, defaultConfigVars: dict):
+    """
+    Adds any configuration keys missing from a loaded configuration using the default configuration. Allows configuration files saved by older versions to keep working after new settings are introduced.
+    Args:
+        * configVars (`dict`): The loaded configuration data. Updated in place
+        * defaultConfigVars (`dict`): The default configuration data
+    Returns:
+        * (`list`): The keys that were added
+    """
+    added_keys = list()
+    for key, value in defaultConfigVars.items():
+        if key not in configVars:
+            configVars[key] = value
+            added_keys.append(key)
+    return added_keys
+
+def lazy_import(name: str):
+    """
+    Imports a module on first use instead of straight away, so that heavy dependencies only cost startup time when they are actually needed
+    Args:
+        * name (`str`): The full name of the module, e.g. "src.plotter". Its parent packages are imported straight away
+    Returns:
+        * (`module`): The module. It is loaded the first time one of its attributes is accessed
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
 def save_configuration(currentWorkingDir: pathlib.Path, fileName: str, directoryName: str, configData: dict):
     """
     Saves user settings as a json file in the config folder from a dictionary
@@ -5,9 +5,10 @@ Created on Wed May 29 2023
 
 @author: elviskasonlin
 """
-import operator
-import scipy
+import functools
 import numpy
+
+import src.instrumentation as INSTR
 from typing import Iterable, Tuple
 
 def intersect(x: numpy.array, f: numpy.array, g: numpy.array) -> Iterable[Tuple[(int, int)]]:
@@ -26,90 +27,178 @@ def intersect(x: numpy.array, f: numpy.array, g: numpy.array) -> Iterable[Tuple[
     return zip(x[idx], f[idx])
 
 
-def get_trace_analysis(target_cutoff_mags: list, sweep_start_f: float, sweep_stop_f: float, trace_data: list):
+@functools.lru_cache(maxsize=16)
+def get_frequency_axis(sweep_start_f: float, sweep_stop_f: float, trace_point_count: int) -> numpy.ndarray:
     """
-    Provided a list of target cutoff magnitudes, sweep range, and trace, it will process and calculate the bandwidth and q factor.
+    Returns the frequency of every trace point for a sweep. Cached per (start, stop, points) and read-only so it can be shared between calls.
     Args:
-        target_cutoff_mags: A list of target magnitudes to calculate bandwidth. Typically -10, -6, and -3
         sweep_start_f: Starting frequency in MHz
         sweep_stop_f: Stop frequency in MHz
-        trace_data: The trace data as a list
+        trace_point_count: Number of points in the sweep
+
+    Returns:
+        The frequencies in MHz
+    """
+    trace_freq = numpy.linspace(start=sweep_start_f, stop=sweep_stop_f, num=trace_point_count, endpoint=True)
+    trace_freq.flags.writeable = False
+    return trace_freq
+
+
+def get_refined_minimum(trace_freq: numpy.ndarray, trace_mag: numpy.ndarray) -> Tuple[float, float]:
+    """
+    Finds the minimum of a trace, refined between samples with the vertex of the parabola through the lowest sample and its two neighbours.
+    Args:
+        trace_freq: The frequency of each trace point
+        trace_mag: The trace magnitudes
 
     Returns:
-        A dictionary object addressable with {is_successful, bandwidth, q_factor, cutoff_mag}
+        The (frequency, magnitude) of the minimum
     """
-    # Get interpolated trace
-    sweep_range = sweep_stop_f - sweep_start_f
+    min_point_idx = int(numpy.argmin(trace_mag))
+    if min_point_idx == 0 or min_point_idx == trace_mag.size - 1:
+        return float(trace_freq[min_point_idx]), float(trace_mag[min_point_idx])
 
-    trace_point_count = len(trace_data)
-    trace_point_delta = sweep_range / (trace_point_count - 1)
-    corresponding_trace_freq = [idx*trace_point_delta+sweep_start_f for idx in range(0, trace_point_count)]
-    interpolated_trace = scipy.interpolate.interp1d(corresponding_trace_freq, trace_data)
+    y_left, y_mid, y_right = trace_mag[min_point_idx - 1:min_point_idx + 2]
+    curvature = y_left - 2 * y_mid + y_right
+    if curvature <= 0:
+        return float(trace_freq[min_point_idx]), float(y_mid)
 
-    # Generate a detailed trace using the interpolated trace function
-    default_trace_points = 1000
-    detail_factor = 1
-    detailed_trace_points = int(default_trace_points * detail_factor)
+    # Vertex offset in samples, always within half a sample of the lowest point
+    offset = 0.5 * (y_left - y_right) / curvature
+    point_delta = trace_freq[1] - trace_freq[0]
+    return float(trace_freq[min_point_idx] + offset * point_delta), float(y_mid - 0.25 * (y_left - y_right) * offset)
+
+
+def get_cutoff_crossings(trace_freq: numpy.ndarray, trace_mag: numpy.ndarray, cutoff_mag: float) -> numpy.ndarray:
+    """
+    Finds where a trace crosses a cutoff magnitude, interpolating linearly between the two samples either side of each crossing.
+    Args:
+        trace_freq: The frequency of each trace point
+        trace_mag: The trace magnitudes
+        cutoff_mag: The cutoff magnitude
+
+    Returns:
+        The crossing frequencies in ascending order
+    """
+    is_above = trace_mag > cutoff_mag
+    idx = numpy.flatnonzero(is_above[:-1] != is_above[1:])
+    mag_before, mag_after = trace_mag[idx], trace_mag[idx + 1]
+    fraction = (cutoff_mag - mag_before) / (mag_after - mag_before)
+    return trace_freq[idx] + fraction * (trace_freq[idx + 1] - trace_freq[idx])
+
+
+@INSTR.timed("calc.trace_analysis")
+def get_trace_analysis(target_cutoff_mags: list, sweep_start_f: float, sweep_stop_f: float, trace_data: list):
+    """
+    Provided a list of target cutoff magnitudes, sweep range, and trace, it will process and calculate the bandwidth and q factor.
+    Works on the trace points directly: the minimum is refined with a quadratic vertex and each cutoff crossing is interpolated between adjacent points. The bandwidth is measured between the nearest crossings either side of the minimum.
+    Args:
+        target_cutoff_mags: A list of target magnitudes to calculate bandwidth. Typically -10, -6, and -3
+        sweep_start_f: Starting frequency in MHz
+        sweep_stop_f: Stop frequency in MHz
+        trace_data: The trace data as a list or a NumPy array
 
-    detailed_trace_freq = numpy.linspace(start=sweep_start_f, stop=sweep_stop_f, endpoint=True, num=detailed_trace_points)
-    detailed_trace_mag = [interpolated_trace(x) for x in detailed_trace_freq]
+    Returns:
+        A dictionary object addressable with {is_successful, bandwidth, q_factor, cutoff_mag, resonance_freq, resonance_mag}
+    """
+    trace_mag = numpy.asarray(trace_data, dtype=numpy.float64)
+    trace_freq = get_frequency_axis(float(sweep_start_f), float(sweep_stop_f), trace_mag.size)
 
     # Find the minimum S11 point in the trace
-    # min_point = scipy.optimize.minimize_scalar(interpolated_trace, method="bounded", bounds=(sweep_start_f, sweep_stop_f))
-    # The above keeps finding the first local minimum so that won't work
-    min_point_idx = numpy.argmin(detailed_trace_mag)
-    min_point = {"x": detailed_trace_freq[min_point_idx], "fun": detailed_trace_mag[min_point_idx]}
-
-    # Run through the target magnitudes, placing priority on the more negative numbers
-    sorted_target_magnitudes = sorted(target_cutoff_mags, reverse=True)
-    # Sorted in ascending order
-    is_cutoff_successful = False
-    cnt_max = len(sorted_target_magnitudes)
-    cnt_cur = 0
+    min_point_freq, min_point_mag = get_refined_minimum(trace_freq=trace_freq, trace_mag=trace_mag)
 
     # Return variable initialisation
+    is_cutoff_successful = False
     bandwidth, q_factor, final_cutoff_mag = None, None, None
 
-    while is_cutoff_successful is False:
-        if cnt_cur >= cnt_max:
-            print("Exceeded count max. Breaking...")
-            break
+    # Run through the target magnitudes from the largest down until one brackets the minimum
+    for cutoff_mag in sorted(target_cutoff_mags, reverse=True):
+        crossings = get_cutoff_crossings(trace_freq=trace_freq, trace_mag=trace_mag, cutoff_mag=cutoff_mag)
+        left_crossings = crossings[crossings < min_point_freq]
+        right_crossings = crossings[crossings > min_point_freq]
+        if left_crossings.size == 0 or right_crossings.size == 0:
+            continue
 
-        # Create a line of target mag measurement with the same number of points as the trace
-        target_cutoff_func = [sorted_target_magnitudes[cnt_cur] for x in detailed_trace_freq]
-        intersection_points = list(intersect(numpy.asarray(detailed_trace_freq), numpy.asarray(detailed_trace_mag),
-                                             numpy.asarray(target_cutoff_func)))
+        # Get bandwidth and Q factor
+        bandwidth = float(right_crossings[0] - left_crossings[-1])
+        q_factor = min_point_freq / bandwidth
+        print(f"For minimum point at {min_point_freq} with mag {min_point_mag}, bandwidth: {bandwidth}, Q factor: {q_factor}")
+        final_cutoff_mag = cutoff_mag
+        is_cutoff_successful = True
+        break
+    else:
+        print("No target cutoff magnitude brackets the minimum point")
 
-        if len(intersection_points) < 2:
-            cnt_cur = cnt_cur + 1
-            continue
-        else:
-            # Get the distance of intersect points to the minimum point and save as a dictionary
-            intersect_points_list_of_dicts = list()
-            for pt in intersection_points:
-                freq = pt[0]
-                mag = pt[1]
-                dist = abs(min_point["x"] - freq)
-                entry_buffer = {"freq": freq, "mag": mag, "dist": dist}
-                intersect_points_list_of_dicts.append(entry_buffer)
-
-            # Sort the points by distance
-            sorted_intersect_points = sorted(intersect_points_list_of_dicts, key=operator.itemgetter("dist"))
-
-            # Get closest points
-            closest_intersect_points = [sorted_intersect_points[0], sorted_intersect_points[1]]
-
-            # Check whether the two points are left and right of the minimum point
-            sorted_intersect_points_by_f = sorted(closest_intersect_points, key=operator.itemgetter("freq"))
-            if not ((sorted_intersect_points_by_f[0]["freq"] < min_point["x"]) and (min_point["x"] < sorted_intersect_points_by_f[1]["freq"])):
-                cnt_cur = cnt_cur + 1
-                continue
-
-            # Get bandwidth and Q factor
-            bandwidth = abs(closest_intersect_points[0]["freq"] - closest_intersect_points[1]["freq"])
-            q_factor = min_point["x"] / bandwidth
-            print(f"For minimum point at {min_point['x']} with mag {min_point['fun']}, bandwidth: {bandwidth}, Q factor: {q_factor}")
-            final_cutoff_mag = sorted_target_magnitudes[cnt_cur]
-            is_cutoff_successful = True
-
-    return {"is_successful": is_cutoff_successful, "bandwidth": bandwidth, "q_factor": q_factor, "cutoff_mag": final_cutoff_mag}
\ No newline at end of file
+    return {"is_successful": is_cutoff_successful, "bandwidth": bandwidth, "q_factor": q_factor, "cutoff_mag": final_cutoff_mag,
+            "resonance_freq": min_point_freq, "resonance_mag": min_point_mag}
+
+
+# Fields of the structured array returned by get_batch_trace_analysis
+BATCH_ANALYSIS_DTYPE = numpy.dtype([("resonance_freq", numpy.float64), ("resonance_mag", numpy.float64),
+                                    ("cutoff_mag", numpy.float64), ("bandwidth", numpy.float64),
+                                    ("q_factor", numpy.float64), ("is_successful", numpy.bool_)])
+
+
+def get_batch_trace_analysis(traces: numpy.ndarray, target_cutoff_mags: list, sweep_start_f: float, sweep_stop_f: float,
+                             max_chunk_elements: int = 4_000_000) -> numpy.ndarray:
+    """
+    Calculates the resonance, bandwidth and Q factor of many traces at every cutoff magnitude at once, using the same method as `get_trace_analysis`.
+    Args:
+        traces: An (N traces x P points) array of traces sharing the same sweep
+        target_cutoff_mags: The C cutoff magnitudes to evaluate
+        sweep_start_f: Starting frequency in MHz
+        sweep_stop_f: Stop frequency in MHz
+        max_chunk_elements: Upper bound on the traces x cutoffs x points processed together, to limit memory use
+
+    Returns:
+        An (N x C) structured array with the fields of `BATCH_ANALYSIS_DTYPE`. Columns follow the order of `target_cutoff_mags`. Bandwidth and Q factor are NaN where a cutoff does not bracket the minimum.
+    """
+    traces = numpy.atleast_2d(numpy.asarray(traces, dtype=numpy.float64))
+    cutoff_mags = numpy.asarray(target_cutoff_mags, dtype=numpy.float64)
+    trace_count, trace_point_count = traces.shape
+    trace_freq = get_frequency_axis(float(sweep_start_f), float(sweep_stop_f), trace_point_count)
+    point_delta = trace_freq[1] - trace_freq[0]
+
+    results = numpy.empty((trace_count, cutoff_mags.size), dtype=BATCH_ANALYSIS_DTYPE)
+    chunk_size = max(1, max_chunk_elements // max(1, cutoff_mags.size * trace_point_count))
+
+    for chunk_start in range(0, trace_count, chunk_size):
+        chunk = traces[chunk_start:chunk_start + chunk_size]
+        rows = numpy.arange(chunk.shape[0])
+
+        # Minimum of each trace, refined with the vertex of the parabola through its neighbours
+        min_point_idx = numpy.argmin(chunk, axis=1)
+        neighbour_idx = numpy.clip(min_point_idx, 1, trace_point_count - 2)
+        y_left = chunk[rows, neighbour_idx - 1]
+        y_mid = chunk[rows, min_point_idx]
+        y_right = chunk[rows, neighbour_idx + 1]
+        curvature = y_left - 2 * y_mid + y_right
+        is_refinable = (min_point_idx == neighbour_idx) & (curvature > 0)
+        offset = numpy.divide(0.5 * (y_left - y_right), curvature, out=numpy.zeros_like(curvature), where=is_refinable)
+        min_point_freq = trace_freq[min_point_idx] + offset * point_delta
+        min_point_mag = y_mid - 0.25 * (y_left - y_right) * offset
+
+        # Crossing frequency of every segment for every cutoff, shaped (traces, cutoffs, segments)
+        cutoff = cutoff_mags[None, :, None]
+        mag_before = chunk[:, None, :-1]
+        mag_after = chunk[:, None, 1:]
+        is_crossing = (mag_before > cutoff) != (mag_after > cutoff)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            crossing_freq = trace_freq[:-1] + (cutoff - mag_before) / (mag_after - mag_before) * point_delta
+
+        # Nearest crossing either side of the minimum
+        min_freq = min_point_freq[:, None, None]
+        left_freq = numpy.where(is_crossing & (crossing_freq < min_freq), crossing_freq, -numpy.inf).max(axis=2)
+        right_freq = numpy.where(is_crossing & (crossing_freq > min_freq), crossing_freq, numpy.inf).min(axis=2)
+        is_successful = numpy.isfinite(left_freq) & numpy.isfinite(right_freq)
+        bandwidth = numpy.where(is_successful, right_freq - left_freq, numpy.nan)
+
+        chunk_results = results[chunk_start:chunk_start + chunk.shape[0]]
+        chunk_results["resonance_freq"] = min_point_freq[:, None]
+        chunk_results["resonance_mag"] = min_point_mag[:, None]
+        chunk_results["cutoff_mag"] = cutoff_mags[None, :]
+        chunk_results["bandwidth"] = bandwidth
+        chunk_results["q_factor"] = min_point_freq[:, None] / bandwidth
+        chunk_results["is_successful"] = is_successful
+
+    return results
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless campaign runner for unattended data acquisition
+Initialises the devices and runs the steps of a run-spec file back-to-back without any prompts
+
+    python -m src.campaign run spec.json
+
+A run-spec is a JSON file such as
+    {
+        "name": "overnight",
+        "load_vna_state": true,
+        "config": {"VNA_POINTS": 401},
+        "steps": [
+            {"start_freq": 750, "stop_freq": 1150, "cycles": 100, "interval": 5.0, "suffix": "wide"},
+            {"start_freq": 900, "stop_freq": 1000, "cycles": 100, "interval": 5.0}
+        ]
+    }
+"config" overrides settings of the configuration file for this campaign only. "load_vna_state" loads the saved VNA state (`VNA_STATE_FILE`) in place of the interactive calibration.
+Each step is measured over its frequency range in MHz, with the resonance searched for where the configured marker search range overlaps it (the whole range if they do not overlap), with a reading started every "interval" seconds, and saved to its own results file, named with its "suffix" (the campaign name and step number if not given)
+"""
+import argparse
+import json
+import pathlib
+import sys
+
+import src.aux_fns as AUXFN
+import src.conn_arduino as ARDCONN
+import src.conn_rsinstrument as INSTCONN
+import src.daq as DAQ
+
+# Exit status codes
+EXIT_SUCCESS = 0
+EXIT_STEP_FAILED = 1
+EXIT_INVALID_SPEC = 2
+EXIT_DEVICE_ERROR = 3
+
+
+def load_campaign_spec(file_path: pathlib.Path, configVars: dict):
+    """
+    Reads and checks a run-spec file
+    Args:
+        file_path: The path to the run-spec JSON file
+        configVars: Configuration variables loaded from the configuration file, used to check the "config" overrides
+
+    Returns: (`dict`) The run-spec with `name`, `load_vna_state`, `config` and `steps` filled in
+    Raises:
+        ValueError: If the file cannot be read or the run-spec is not valid
+    """
+    try:
+        with open(file_path, "r") as file:
+            spec = json.load(file)
+    except (OSError, json.JSONDecodeError) as err:
+        raise ValueError(f"Unable to read run-spec {file_path}: {err}")
+
+    if not isinstance(spec, dict) or not isinstance(spec.get("steps"), list) or not spec["steps"]:
+        raise ValueError("The run-spec needs a non-empty list of \"steps\"")
+
+    spec.setdefault("name", pathlib.Path(file_path).stem)
+    spec.setdefault("load_vna_state", False)
+    spec.setdefault("config", dict())
+    unknown_keys = [key for key in spec["config"] if key not in configVars]
+    if unknown_keys:
+        raise ValueError(f"Unknown configuration settings in run-spec: {unknown_keys}")
+
+    for step_no, step in enumerate(spec["steps"], start=1):
+        missing_keys = [key for key in ("start_freq", "stop_freq", "cycles", "interval") if key not in step]
+        if missing_keys:
+            raise ValueError(f"Step {step_no} is missing {missing_keys}")
+        try:
+            step["start_freq"] = float(step["start_freq"])
+            step["stop_freq"] = float(step["stop_freq"])
+            step["cycles"] = int(step["cycles"])
+            step["interval"] = float(step["interval"])
+        except (TypeError, ValueError) as err:
+            raise ValueError(f"Step {step_no} has a value that is not a number: {err}")
+        if not (1 <= step["start_freq"] < step["stop_freq"] <= 8000):
+            raise ValueError(f"Step {step_no} has an invalid frequency range {step['start_freq']}-{step['stop_freq']} MHz")
+        if step["cycles"] < 1 or step["interval"] < 0:
+            raise ValueError(f"Step {step_no} needs at least 1 cycle and a non-negative interval")
+        step.setdefault("suffix", f"{spec['name']}-{step_no}")
+    return spec
+
+
+def get_marker_search_limits(configVars: dict, startFreq: float, stopFreq: float):
+    """
+    Fits the configured marker search range to a step's frequency range, so that the resonance is searched for within the sweep
+    Returns: (`float`, `float`) The left and right search limits in MHz. The whole step's range if the configured one does not overlap it
+    """
+    left_freq = max(configVars["VNA_MARKER_SEARCH_LEFT_FREQ"], startFreq)
+    right_freq = min(configVars["VNA_MARKER_SEARCH_RIGHT_FREQ"], stopFreq)
+    if left_freq >= right_freq:
+        return startFreq, stopFreq
+    return left_freq, right_freq
+
+
+def initialise_devices(configVars: dict, loadVnaState: bool):
+    """
+    Connects to the Arduino and the VNA and sets the VNA up, without prompting
+    Returns: (`INSTCONN.VnaSession`, `serial.Serial`, `ARDCONN.SerialLineReader`) The devices, or `None` in place of each if any of them could not be initialised
+    """
+    print(f"INITIALISE Establishing connection with Arduino at {configVars['ARDUINO_PORT']}...")
+    serialObject, ard_conn_is_ready = ARDCONN.establish_connection(configVariables=configVars)
+    if not ard_conn_is_ready:
+        print("ERROR Unable to connect to the Arduino")
+        return None, None, None
+
+    print(f"INITIALISE Establishing connection with VNA at {configVars['VNA_RESOURCE']}...")
+    vna_session = INSTCONN.VnaSession(configVars=configVars)
+    if not vna_session.connect():
+        print("ERROR Unable to connect to the VNA")
+        serialObject.close()
+        return None, None, None
+
+    if loadVnaState:
+        INSTCONN.load_calibration(instrument=vna_session.instrument, cal_name=configVars["VNA_STATE_FILE"])
+    vna_session.setup()
+    line_reader = ARDCONN.start_line_reader(serialObject=serialObject)
+    print("SUCCESS All devices initialised")
+    return vna_session, serialObject, line_reader
+
+
+def run_campaign(spec: dict, configVars: dict):
+    """
+    Runs every step of a run-spec in order. The campaign stops at the first step that does not take all of its readings
+    Returns: (`int`) The exit status code
+    """
+    campaign_config = dict(configVars)
+    campaign_config.update(spec["config"])
+    search_config = dict(campaign_config)
+
+    vna_session, serialObject, line_reader = initialise_devices(configVars=campaign_config, loadVnaState=spec["load_vna_state"])
+    if vna_session is None:
+        return EXIT_DEVICE_ERROR
+
+    exit_code = EXIT_SUCCESS
+    try:
+        for step_no, step in enumerate(spec["steps"], start=1):
+            print(f"CAMPAIGN {spec['name']} step {step_no} of {len(spec['steps'])}: {step['start_freq']}-{step['stop_freq']} MHz, {step['cycles']} cycles every {step['interval']} s")
+            campaign_config["VNA_START_FREQ"] = step["start_freq"]
+            campaign_config["VNA_STOP_FREQ"] = step["stop_freq"]
+            campaign_config["VNA_MARKER_SEARCH_LEFT_FREQ"], campaign_config["VNA_MARKER_SEARCH_RIGHT_FREQ"] = get_marker_search_limits(
+                configVars=search_config, startFreq=step["start_freq"], stopFreq=step["stop_freq"])
+            vna_session.setup()
+
+            cycle_count, is_complete = DAQ.run_acquisition(vnaSession=vna_session, serialObject=serialObject,
+                                                           configVars=campaign_config, cycles=step["cycles"],
+                                                           cyclePeriod=step["interval"], fileSuffix=str(step["suffix"]),
+                                                           lineReader=line_reader)
+            if not is_complete:
+                print(f"ERROR Step {step_no} stopped after {cycle_count} of {step['cycles']} cycles. Ending campaign")
+                exit_code = EXIT_STEP_FAILED
+                break
+        else:
+            print(f"CAMPAIGN {spec['name']} completed all {len(spec['steps'])} steps")
+    except Exception as err:
+        print(f"ERROR Campaign ended by an error: {err}")
+        exit_code = EXIT_STEP_FAILED
+    finally:
+        line_reader.stop()
+        vna_session.close()
+        serialObject.close()
+    return exit_code
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m src.campaign", description="Runs data acquisition campaigns without prompts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run the steps of a run-spec file")
+    run_parser.add_argument("spec", type=pathlib.Path, help="Path to the run-spec JSON file")
+    args = parser.parse_args(argv)
+
+    default_config_vars = AUXFN.get_default_configuration()
+    try:
+        config_vars = AUXFN.load_configuration(currentWorkingDir=pathlib.Path.cwd(), fileName=default_config_vars["CONFIG_FILE_NAME"], directoryName=default_config_vars["CONFIG_FOLDER"])
+    except FileNotFoundError:
+        print("WARNING Configuration file not found. Using the default configuration")
+        config_vars = default_config_vars
+    AUXFN.fill_missing_configuration(configVars=config_vars, defaultConfigVars=default_config_vars)
+
+    try:
+        spec = load_campaign_spec(file_path=args.spec, configVars=config_vars)
+    except ValueError as err:
+        print(f"ERROR {err}")
+        return EXIT_INVALID_SPEC
+
+    return run_campaign(spec=spec, configVars=config_vars)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,10 +6,20 @@ Created on Wed May 17 2023
 @author: elviskasonlin
 """
 
-import waiting
+import queue
+import threading
 import serial
 import time
 
+import src.aux_fns as AUXFN
+import src.instrumentation as INSTR
+
+# Only needed for the handshake and polled reads
+waiting = AUXFN.lazy_import("waiting")
+
+# Ports starting with this select the Arduino emulator in src/sim_arduino.py. It is only imported when selected, as it needs the POSIX pseudo-terminals that Windows does not have
+SIM_PORT_PREFIX = "SIM::"
+
 
 def read_serial(serialObject: serial.Serial):
     """
@@ -97,19 +107,116 @@ def handshake_connection(serialObject: serial.Serial, timeout: float, pollingRat
     return conn_status_flag
 
 
+class SerialLineReader:
+    """
+    Reads from the Arduino in a background thread and queues each complete line, so callers wait on the queue with a timeout instead of polling `readline`
+    """
+
+    def __init__(self, serialObject: serial.Serial, pollInterval: float = 0.05):
+        self.serial_object = serialObject
+        self.poll_interval = pollInterval
+        self._lines = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # The reader blocks for at most `poll_interval` so that it notices when it is stopped
+        self.serial_object.timeout = self.poll_interval
+        # The handshake leaves replies in flight that would otherwise be taken for the first reading
+        self.serial_object.reset_input_buffer()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._read_lines, name="SerialLineReader", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def clear(self):
+        """
+        Discards any lines that have been received but not collected
+        """
+        while True:
+            try:
+                self._lines.get_nowait()
+            except queue.Empty:
+                break
+
+    def get_line(self, timeout: float):
+        """
+        Waits for the next complete line from the Arduino
+        Args:
+            timeout (`float`): The longest time to wait in seconds
+
+        Returns:
+            (`str`) The decoded line without its line ending, or `None` if nothing arrived in time
+        """
+        try:
+            return self._lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _read_lines(self):
+        buffer = bytearray()
+        while not self._stop_event.is_set():
+            try:
+                buffer += self.serial_object.read(self.serial_object.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError) as err:
+                print(f"ERROR Serial reader stopped: {err}")
+                break
+            while b"\n" in buffer:
+                line, _, buffer = buffer.partition(b"\n")
+                line = line.decode(encoding="ascii", errors="replace").strip()
+                if line != "":
+                    self._lines.put(line)
+
+
+def start_line_reader(serialObject: serial.Serial):
+    """
+    Starts a `SerialLineReader` on a connected Arduino. Call after the handshake as the reader takes over all reads
+    Args:
+        serialObject (`serial.Serial`): The serial object
+
+    Returns:
+        (`SerialLineReader`) The running reader
+    """
+    return SerialLineReader(serialObject=serialObject).start()
+
+
 def poll_arduino_reading(serialObject: serial.Serial):
     read_data = read_serial(serialObject)
     if (read_data != ""):
         return read_data
 
 
-def get_FSR_vals(serialObject: serial.Serial, data_selection: str):
+def parse_FSR_reply(line: str):
+    """
+    Parses a reply to an "INST:READ" command
+    Returns: (`list`) The values as floats, or `None` if the line is not a reply of comma-separated numbers, such as a late handshake reply
+    """
+    if line is None or line == "":
+        return None
+    try:
+        return [float(each.strip()) for each in line.split(",")]
+    except ValueError:
+        return None
+
+
+def get_FSR_vals(serialObject: serial.Serial, data_selection: str, lineReader: SerialLineReader = None, timeout: float = 1.0):
     """
     Gets the force-sensing resistor values from the Arduino and returns them as a string of values
 
     Args:
         serialObject (`serial.Serial`): The serial object
         data_selection (`str`): Which data you would like from the FSR. Valid options are "voltage", "resistance", "force", and "all"
+        lineReader (`SerialLineReader`): The running line reader if there is one. Without it the reply is polled for with `readline`
+        timeout (`float`): The longest time to wait for the reply in seconds
 
     Returns: (`list`, `bool`) data and whether the connection was successful. If unsuccessful, `"", False`
 
@@ -139,19 +246,29 @@ def get_FSR_vals(serialObject: serial.Serial, data_selection: str):
 
     if serialObject.isOpen():
         try:
-            serialObject.flushInput()
-            serialObject.flushOutput()
-
-            write_serial(write_data, serialObject)
             read_data = ""
             try:
-                pollingRate = 0.1
-                timeout = 1.0
-                read_data = waiting.wait(lambda: poll_arduino_reading(serialObject=serialObject), timeout_seconds=timeout, sleep_seconds=pollingRate)
-                read_data = read_data.split(",")
-                for idx, each in enumerate(read_data):
-                    read_data[idx] = each.strip()
-                    read_data[idx] = float(read_data[idx])
+                if lineReader is not None:
+                    # Drop stale replies, then wait on the reader's queue for this one
+                    lineReader.clear()
+                    write_serial(write_data, serialObject)
+                    deadline = time.monotonic() + timeout
+                    read_data = None
+                    while read_data is None:
+                        remaining = deadline - time.monotonic()
+                        line = lineReader.get_line(timeout=remaining) if remaining > 0 else None
+                        if line is None:
+                            raise waiting.exceptions.TimeoutExpired(timeout, write_data.strip())
+                        # Lines that are not numbers are left over from earlier exchanges
+                        read_data = parse_FSR_reply(line)
+                        if read_data is None:
+                            print(f"NOTICE Discarded unexpected line from Arduino: {line}")
+                else:
+                    serialObject.flushInput()
+                    serialObject.flushOutput()
+                    write_serial(write_data, serialObject)
+                    pollingRate = 0.1
+                    read_data = waiting.wait(lambda: parse_FSR_reply(poll_arduino_reading(serialObject=serialObject)), timeout_seconds=timeout, sleep_seconds=pollingRate)
             except waiting.exceptions.TimeoutExpired:
                 print("Operation Timed Out! Unable to get any results from Arduino")
                 return read_data, False
@@ -163,6 +280,26 @@ def get_FSR_vals(serialObject: serial.Serial, data_selection: str):
     return read_data, True
 
 
+@INSTR.timed("fsr.read")
+def get_FSR_res_and_vol(serialObject: serial.Serial, lineReader: SerialLineReader = None, timeout: float = 1.0):
+    """
+    Gets both the resistance and voltage readings in a single "INST:READ:ALL" exchange
+
+    Args:
+        serialObject (`serial.Serial`): The serial object
+        lineReader (`SerialLineReader`): The running line reader if there is one
+        timeout (`float`): The longest time to wait for the reply in seconds
+
+    Returns: (`list`, `list`, `bool`) The inner and outer resistances, the inner and outer voltages, and whether the read was successful
+
+    """
+    read_data, read_status = get_FSR_vals(serialObject=serialObject, data_selection="all", lineReader=lineReader, timeout=timeout)
+    if not read_status or len(read_data) != 4:
+        return [], [], False
+    # The firmware replies with the resistances followed by the voltages
+    return read_data[0:2], read_data[2:4], True
+
+
 def current_time_ms():
     return round(time.time() * 1000)
 
@@ -181,10 +318,20 @@ def establish_connection(configVariables: dict):
         case _:
             serial_parity = serial.PARITY_NONE
 
+    serial_port = configVariables["ARDUINO_PORT"]
+    if str(serial_port).upper().startswith(SIM_PORT_PREFIX):
+        try:
+            import src.sim_arduino as SIMARD
+        except ImportError as err:
+            print(f"ERROR The Arduino emulator ({serial_port}) needs POSIX pseudo-terminals (termios), which this platform does not have: {err}")
+            return serial_object, ard_conn_is_ready
+        serial_port = SIMARD.open_emulator(configVars=configVariables).port_name
+        print(f"NOTICE Using the Arduino emulator on {serial_port}")
+
     try:
         serial_object = serial.Serial(
                 baudrate=configVariables["ARDUINO_BAUD"],
-                port=configVariables["ARDUINO_PORT"],
+                port=serial_port,
                 bytesize=serial.EIGHTBITS,
                 parity=serial_parity,
                 stopbits=serial.STOPBITS_ONE,
@@ -1,24 +1,52 @@
+import time
+import weakref
+
 import RsInstrument
 import pyvisa.errors
+import numpy
 
 import src.aux_fns as AUXFN
+import src.instrumentation as INSTR
+import src.sim_rsinstrument as SIMINST
+
+# Last-known value of every setting sent through `write_settings`, per instrument object
+SHADOW_STATES = weakref.WeakKeyDictionary()
+
+REFERENCE_IMPEDANCE = 50.0
 
 def list_available_devices():
     instrument_list = RsInstrument.RsInstrument.list_resources("?*")
+    # The simulated instrument is always available
+    instrument_list.append(SIMINST.SIM_RESOURCE_PREFIX + "ZVH8")
     return instrument_list
 
 
-def establish_connection(configVars: dict):
+def establish_connection(configVars: dict, reset: bool = None):
+    """
+    Opens a session to the VNA and checks its identity. Without a reset the instrument keeps its settings and calibration, so an instrument that is already configured can be reattached to. `VnaSession.reconnect` always reattaches without a reset
+    Args:
+        configVars: Configuration variables loaded from the configuration file
+        reset: Whether to reset the instrument on connection. Defaults to `VNA_RESET_ON_CONNECT`, which resets it as the initial connection always did
+
+    Returns: The instrument object and whether the connection is ready
+    """
     instrument = RsInstrument.RsInstrument
     RSINST_CONN_IS_READY = False
+    if reset is None:
+        reset = configVars["VNA_RESET_ON_CONNECT"]
 
     try:
-        instrument = RsInstrument.RsInstrument(resource_name=configVars["VNA_RESOURCE"], id_query=True, reset=True,
-                                               options="SelectVisa='rs', LoggingMode=Off, LoggingToConsole=False")
+        if SIMINST.is_sim_resource(configVars["VNA_RESOURCE"]):
+            instrument = SIMINST.open_instrument(resourceName=configVars["VNA_RESOURCE"], configVars=configVars, reset=reset)
+        else:
+            instrument = RsInstrument.RsInstrument(resource_name=configVars["VNA_RESOURCE"], id_query=True, reset=reset,
+                                                   options="SelectVisa='rs', LoggingMode=Off, LoggingToConsole=False")
 
-        instrument.visa_timeout = 5000
-        instrument.opc_timeout = 5000
+        instrument.visa_timeout = configVars["VNA_TIMEOUT_MIN"]
+        instrument.opc_timeout = configVars["VNA_TIMEOUT_MIN"]
         instrument.clear_status()
+        # Nothing is known about the settings of a new session until they are sent again
+        invalidate_shadow_state(instrument)
         idn_response = instrument.query_str_with_opc("*IDN?")
         print(f"Device connected to is {idn_response}")
         RSINST_CONN_IS_READY = True
@@ -36,23 +64,138 @@ def establish_connection(configVars: dict):
 
 def vna_measurement_setup(instrument: RsInstrument.RsInstrument, configVars: dict):
     # Define all your measurement setups here
-    instrument.write_str_with_opc("MEAS:PORT 1") # Select port 1
-    instrument.write_str_with_opc("MEAS:FUNC:SEL S11") # Select S11 measurement
-    instrument.write_str_with_opc("DISP:MAGN:Y:SPAC LOG") # Log space (dB) Y axis
-    instrument.write_str_with_opc("DISP:MAGN:REF 0") # Set reference level at 0dB
-    instrument.write_str_with_opc("DISP:MAGN:Y:SCAL 60") # Set the Y scale at 60 dB
-    # Start frequency
-    instrument.write_str_with_opc(f'SENSe1:FREQuency:STARt {configVars["VNA_START_FREQ"]}MHz')
-    # Stop frequency
-    instrument.write_str_with_opc(f'SENSe1:FREQuency:STOP {configVars["VNA_STOP_FREQ"]}MHz')
-    # Set number of sweep points to the defined number
-    instrument.write_with_opc('SENSe1:SWEep:POINts ' + str(configVars["VNA_POINTS"]))
-    # Set single sweep mode and stop acquisition
-    instrument.write_str_with_opc("INIT1:CONT ON")
+    setup_commands = [
+        "MEAS:PORT 1", # Select port 1
+        "MEAS:FUNC:SEL S11", # Select S11 measurement
+        "DISP:MAGN:Y:SPAC LOG", # Log space (dB) Y axis
+        "DISP:MAGN:REF 0", # Set reference level at 0dB
+        "DISP:MAGN:Y:SCAL 60", # Set the Y scale at 60 dB
+        f'SENSe1:FREQuency:STARt {configVars["VNA_START_FREQ"]}MHz', # Start frequency
+        f'SENSe1:FREQuency:STOP {configVars["VNA_STOP_FREQ"]}MHz', # Stop frequency
+        f'SENSe1:SWEep:POINts {configVars["VNA_POINTS"]}' # Set number of sweep points to the defined number
+    ]
+    # Continuous sweeps, or single sweeps triggered by each acquisition
+    if configVars["VNA_TRIGGER_MODE"] == "single":
+        setup_commands.append("INIT1:CONT OFF")
+    else:
+        setup_commands.append("INIT1:CONT ON")
+
+    failed_commands = write_settings(instrument=instrument, commands=setup_commands)
+    if failed_commands:
+        print(f"WARNING {len(failed_commands)} of {len(setup_commands)} VNA setup commands failed")
+    apply_sweep_time_timeouts(instrument=instrument, configVars=configVars)
+    return
+
+
+def write_command_batch(instrument: RsInstrument.RsInstrument, commands: list):
+    """
+    Sends setting commands as one compound SCPI message with a single completion check and a single read of the error queue, instead of one *OPC round-trip per command.
+    If the instrument reports errors, the commands are sent again one at a time to find out which of them failed
+    Args:
+        instrument: The RsInstrument object that has already been initialised
+        commands: Setting commands with absolute headers, e.g. "SENSe1:FREQuency:STARt 750MHz"
+
+    Returns: (`list`) `(command, errors)` for every command that failed, empty if all of them succeeded
+    """
+    failed_commands = list()
+    if not commands:
+        return failed_commands
+
+    # Root every header so that each command is independent of the one before it in the compound message
+    message = ";".join(cmd if cmd.startswith((":", "*")) else ":" + cmd for cmd in commands)
+
+    status_checking = instrument.instrument_status_checking
+    instrument.instrument_status_checking = False
+    try:
+        instrument.write_str_with_opc(message)
+        errors = instrument.query_all_errors()
+        if errors:
+            for cmd in commands:
+                instrument.write_str_with_opc(cmd)
+                cmd_errors = instrument.query_all_errors()
+                if cmd_errors:
+                    print(f"ERROR VNA setup command '{cmd}' failed with: {', '.join(cmd_errors)}")
+                    failed_commands.append((cmd, cmd_errors))
+            if not failed_commands:
+                print(f"WARNING VNA reported errors for the batched setup that did not repeat per command: {', '.join(errors)}")
+    finally:
+        instrument.instrument_status_checking = status_checking
+    return failed_commands
+
+
+def get_shadow_state(instrument: RsInstrument.RsInstrument):
+    """
+    Returns: (`dict`) The instrument's last-known settings as `{header: value}`, created empty on first use
+    """
+    if instrument not in SHADOW_STATES:
+        SHADOW_STATES[instrument] = dict()
+    return SHADOW_STATES[instrument]
+
+
+def invalidate_shadow_state(instrument: RsInstrument.RsInstrument):
+    """
+    Forgets the instrument's last-known settings, so that the next `write_settings` sends all of them. Needed after a *RST, a state load or a reconnect
+    """
+    SHADOW_STATES.pop(instrument, None)
     return
 
 
+def get_setting_header(command: str):
+    # Headers are compared case-insensitively, without the leading ":"
+    return command.partition(" ")[0].lstrip(":").upper()
+
+
+def write_settings(instrument: RsInstrument.RsInstrument, commands: list):
+    """
+    Sends only the setting commands whose value differs from the instrument's shadow state, as one batch with `write_command_batch`, and records the ones that succeeded
+    Args:
+        instrument: The RsInstrument object that has already been initialised
+        commands: Setting commands as "header value", e.g. "SENSe1:FREQuency:STARt 750MHz"
+
+    Returns: (`list`) `(command, errors)` for every command that failed, empty if all of them succeeded
+    """
+    shadow_state = get_shadow_state(instrument)
+    changed_commands = [cmd for cmd in commands
+                        if shadow_state.get(get_setting_header(cmd)) != cmd.partition(" ")[2].strip()]
+    if not changed_commands:
+        return list()
+
+    failed_commands = write_command_batch(instrument=instrument, commands=changed_commands)
+    failed = set(cmd for cmd, _ in failed_commands)
+    for cmd in changed_commands:
+        if cmd in failed:
+            shadow_state.pop(get_setting_header(cmd), None)
+        else:
+            shadow_state[get_setting_header(cmd)] = cmd.partition(" ")[2].strip()
+    return failed_commands
+
+
+def apply_sweep_time_timeouts(instrument: RsInstrument.RsInstrument, configVars: dict):
+    """
+    Sets the VISA and OPC timeouts from the sweep time the instrument reports for the current points and span, so that waiting on a sweep neither times out early nor hangs for long on a dead connection
+    Args:
+        instrument: The RsInstrument object that has already been initialised
+        configVars: Configuration variables loaded from the configuration file
+
+    Returns: (`float`) The sweep time in seconds, or `None` if the instrument did not report one
+    """
+    try:
+        sweep_time = float(instrument.query_str_with_opc("SENSe1:SWEep:TIME?"))
+    except (RsInstrument.RsInstrException, ValueError) as err:
+        print(f"WARNING Unable to read the sweep time, keeping the current timeouts: {err}")
+        return None
+
+    timeout = int(sweep_time * 1000 * configVars["VNA_TIMEOUT_SWEEP_FACTOR"] + configVars["VNA_TIMEOUT_MARGIN"])
+    timeout = max(timeout, configVars["VNA_TIMEOUT_MIN"])
+    instrument.visa_timeout = timeout
+    instrument.opc_timeout = timeout
+    print(f"NOTICE Sweep time is {sweep_time} s. VNA timeouts set to {timeout} ms")
+    return sweep_time
+
+
 def load_calibration(instrument: RsInstrument.RsInstrument, cal_name: str):
+    # The loaded state replaces every setting on the instrument
+    invalidate_shadow_state(instrument)
     try:
         instrument.write_str_with_opc("MMEMory:LOAD:STATe 1,'CTRL_CAL_STATE.SET'")
     except Exception as err:
@@ -96,37 +239,142 @@ def calibrate_instrument(instrument: RsInstrument.RsInstrument, configVars: dict
     return
 
 
-def acquire_vna_data(instrument: RsInstrument.RsInstrument, configVars: dict):
+def prepare_acquisition_plan(instrument: RsInstrument.RsInstrument, configVars: dict):
+    """
+    Configures the marker search and trace format once so that each sweep only needs its queries. Must be prepared again after the measurement setup changes or an instrument state is loaded.
+    Args:
+        instrument: The RsInstrument object that has already been initialised
+        configVars: Configuration variables loaded from the configuration file
+
+    Returns: A dict with `marker_query`, `trace_query`, `trace_format`, `trace_points`, `trigger_command` and `is_armed` to be passed to `acquire_vna_data`
+    """
+    plan_commands = [
+        "CALCulate:MARKer1 ON",
+        "CALCulate:MARKer1:X:SLIMits ON",
+        f'CALCulate:MARKer1:X:SLIMits:RIGHt {configVars["VNA_MARKER_SEARCH_RIGHT_FREQ"]}MHz',
+        f'CALCulate:MARKer1:X:SLIMits:LEFT {configVars["VNA_MARKER_SEARCH_LEFT_FREQ"]}MHz'
+    ]
+
+    trace_format = configVars["VNA_TRACE_FORMAT"]
+    if trace_format == "REAL32":
+        # Least significant byte first, as `get_trace_data` decodes it
+        plan_commands.extend(["FORMat REAL,32", "FORMat:BORDer SWAPped"])
+    else:
+        plan_commands.append("FORMat ASCii")
+
+    if configVars["VNA_COMPUTE_MARKER_IMPEDANCE"]:
+        # The marker stays in Magnitude in dB with Phase and the impedance is calculated from it
+        plan_commands.append("CALCulate:MARKer1:MODE RPDB")
+        marker_query = "CALCulate:MARKer1:MINimum:PEAK;:CALCulate:MARKer1:Y?"
+    else:
+        # Marker search and both marker formats in one message. The responses come back separated by ";"
+        marker_query = ";".join(["CALCulate:MARKer1:MINimum:PEAK",
+                                 ":CALCulate:MARKer1:MODE RPDB",  # Marker format of Magnitude in dB with Phase
+                                 ":CALCulate:MARKer1:Y?",
+                                 ":CALCulate:MARKer1:MODE IMPedance",  # Marker format of Impedance with real and imag.
+                                 ":CALCulate:MARKer1:Y?"])
+        # The query leaves the marker mode changed behind the shadow's back
+        get_shadow_state(instrument).pop(get_setting_header("CALCulate:MARKer1:MODE"), None)
+
+    write_settings(instrument=instrument, commands=plan_commands)
+
+    acquisition_plan = {
+        "marker_query": marker_query,
+        "trace_query": "TRACe:DATA? TRACE1",
+        "trace_format": trace_format,
+        "trace_points": int(configVars["VNA_POINTS"]),
+        "trigger_command": "INITiate1:IMMediate" if configVars["VNA_TRIGGER_MODE"] == "single" else None,
+        # Whether a sweep was started ahead of the next acquisition, see `acquire_vna_data`
+        "is_armed": False
+    }
+    return acquisition_plan
+
+
+@INSTR.timed("vna.trace_transfer")
+def get_trace_data(instrument: RsInstrument.RsInstrument, acquisitionPlan: dict):
+    """
+    Reads the trace currently held by the VNA as a NumPy array.
+    With the plan's `trace_format` set to "REAL32" the trace is transferred as a binary block of little-endian 32-bit floats and decoded without copying. Any other value uses the ASCII transfer. A failed binary transfer, or one without the plan's `trace_points` values, is read again in ASCII for that sweep, and the next sweep is transferred in binary again.
+    Args:
+        instrument: The RsInstrument object that has already been initialised
+        acquisitionPlan: The plan returned by `prepare_acquisition_plan`
+
+    Returns: (`numpy.ndarray`) The trace magnitudes in dB
+    """
+    if acquisitionPlan["trace_format"] == "REAL32":
+        try:
+            trace_block = instrument.query_bin_block_with_opc(acquisitionPlan["trace_query"])
+            trace_data = numpy.frombuffer(trace_block, dtype="<f4")
+            if trace_data.size != acquisitionPlan["trace_points"]:
+                raise ValueError(f"Received {trace_data.size} of {acquisitionPlan['trace_points']} trace points")
+            return trace_data
+        except (RsInstrument.RsInstrException, ValueError) as err:
+            # ValueError is a block that is not a whole number of floats, or not a whole trace
+            print(f"WARNING Binary trace transfer failed, reading this sweep in ASCII instead: {err}")
+            write_settings(instrument=instrument, commands=["FORMat ASCii"])
+            try:
+                return get_ascii_trace_data(instrument=instrument, acquisitionPlan=acquisitionPlan)
+            finally:
+                write_settings(instrument=instrument, commands=["FORMat REAL,32"])
+
+    return get_ascii_trace_data(instrument=instrument, acquisitionPlan=acquisitionPlan)
+
+
+def get_ascii_trace_data(instrument: RsInstrument.RsInstrument, acquisitionPlan: dict):
+    trace_data = instrument.query_bin_or_ascii_float_list_with_opc(acquisitionPlan["trace_query"])
+    return numpy.asarray(trace_data, dtype=numpy.float64)
+
+
+def acquire_vna_data(instrument: RsInstrument.RsInstrument, configVars: dict, acquisitionPlan: dict = None, preArm: bool = False):
     """
     Gets the trace data and marker (min.) data from the VNA and processes it to provide magnitude, impedance etc.
+    In single sweep mode the sweep is triggered when the acquisition starts, so that the data is from the moment it is taken. With `preArm`, the next sweep is started as soon as this one is read instead, to run while this one is processed. This only suits readings taken back-to-back, as a pre-armed sweep is as old as the wait before the next acquisition
     Args:
         instrument: The RsInstrument object that has already been initialised
         configVars: Configuration variables loaded from the configuration file
+        acquisitionPlan: The plan returned by `prepare_acquisition_plan`. Prepared on the spot if not given
+        preArm: Whether to start the next sweep at the end of this acquisition
 
-    Returns: A dict with `minpt_mag_dB`, `minpt_mag_phase`, `minpt_imp_real`, `minpt_imp_j`, `min_pt_freq`, `min_pt_mag`, `trace_data`
+    Returns: A dict with `minpt_mag_dB`, `minpt_mag_phase`, `minpt_imp_real`, `minpt_imp_j`, `min_pt_freq`, `min_pt_mag`, `trace_data` (as a `numpy.ndarray`)
     """
-    instrument.write_str_with_opc("CALCulate:MARKer1 ON")
-    instrument.write_str_with_opc("CALCulate:MARKer1:X:SLIMits ON")
-    instrument.write_str_with_opc("CALCulate:MARKer1:X:SLIMits:RIGHt 1.15GHz")
-    instrument.write_str_with_opc("CALCulate:MARKer1:X:SLIMits:LEFT 750MHz")
-    instrument.write_str_with_opc("CALCulate:MARKer1:MINimum:PEAK")
+    if acquisitionPlan is None:
+        acquisitionPlan = prepare_acquisition_plan(instrument=instrument, configVars=configVars)
+
+    # In single sweep mode, wait for a new, whole sweep to complete before reading it
+    if acquisitionPlan["trigger_command"] is not None:
+        with INSTR.span("vna.sweep_wait"):
+            if acquisitionPlan["is_armed"]:
+                instrument.query_opc()
+            if not (acquisitionPlan["is_armed"] and preArm):
+                # A sweep armed by an earlier back-to-back run is too old to use
+                instrument.write_str_with_opc(acquisitionPlan["trigger_command"])
+        acquisitionPlan["is_armed"] = False
 
-    instrument.write_str_with_opc("CALCulate:MARKer1:MODE RPDB") # Marker format of Magnitude in dB with Phase
-    minpt_mag = str(instrument.query_str_with_opc("CALC:MARK1:Y?")).split(",")
-    instrument.write_str_with_opc("CALCulate:MARKer1:MODE IMPedance") # Market format of Impedance with real and imag.
-    minpt_imp = str(instrument.query_str_with_opc("CALC:MARK1:Y?")).split(",")
+    with INSTR.span("vna.marker_query"):
+        marker_response = str(instrument.query_str_with_opc(acquisitionPlan["marker_query"])).split(";")
+    minpt_mag = marker_response[0].split(",")
 
     minpt_mag_dB = minpt_mag[0]
     minpt_mag_phase = minpt_mag[1]
-    minpt_imp_real = minpt_imp[0]
-    minpt_imp_j = minpt_imp[1]
+    if len(marker_response) > 1:
+        minpt_imp = marker_response[1].split(",")
+        minpt_imp_real = minpt_imp[0]
+        minpt_imp_j = minpt_imp[1]
+    else:
+        minpt_imp_real, minpt_imp_j = get_marker_impedance(mag_dB=float(minpt_mag_dB), phase_deg=float(minpt_mag_phase))
 
-    instrument.write_str_with_opc("FORMat ASCii")
-    trace_data = instrument.query_bin_or_ascii_float_list_with_opc("TRACe:DATA? TRACE1")
+    trace_data = get_trace_data(instrument=instrument, acquisitionPlan=acquisitionPlan)
     #print("DEBUG CH1 Trace Result Data is: ", trace_data)
+
+    # Start the next sweep straight away so that it runs while this one is processed
+    if acquisitionPlan["trigger_command"] is not None and preArm:
+        with INSTR.span("vna.trigger"):
+            instrument.write_str(acquisitionPlan["trigger_command"])
+        acquisitionPlan["is_armed"] = True
     vna_bandwidth = configVars["VNA_STOP_FREQ"] - configVars["VNA_START_FREQ"]
-    min_pt_mag = min(trace_data)
-    min_pt_freq = trace_data.index(min_pt_mag) / (configVars["VNA_POINTS"] - 1) * vna_bandwidth + configVars["VNA_START_FREQ"]
+    min_pt_idx = int(numpy.argmin(trace_data))
+    min_pt_mag = float(trace_data[min_pt_idx])
+    min_pt_freq = min_pt_idx / (len(trace_data) - 1) * vna_bandwidth + configVars["VNA_START_FREQ"]
     #print(f"DEBUG min freq: {min_pt_freq}")
 
     return_data = {
@@ -138,4 +386,95 @@ def acquire_vna_data(instrument: RsInstrument.RsInstrument, configVars: dict):
         "min_pt_mag": min_pt_mag,
         "trace_data": trace_data
     }
-    return return_data
\ No newline at end of file
+    return return_data
+
+
+def get_marker_impedance(mag_dB: float, phase_deg: float):
+    """
+    Converts a marker reading in dB and degrees to the impedance that the IMPedance marker mode would show
+    Returns: (`float`, `float`) The real and imaginary parts of the impedance in ohm
+    """
+    gamma = pow(10, mag_dB / 20) * numpy.exp(1j * numpy.radians(phase_deg))
+    impedance = REFERENCE_IMPEDANCE * (1 + gamma) / (1 - gamma)
+    return float(impedance.real), float(impedance.imag)
+
+
+class VnaSession:
+    """
+    Keeps the VNA connection together with its acquisition plan. If the connection drops during an acquisition, the session reattaches to the instrument without resetting it, with an increasing delay between attempts, then applies the measurement setup again.
+    A dropped connection costs the sweep that was being read. `acquire` returns `None` for it
+    """
+
+    def __init__(self, configVars: dict):
+        self.config_vars = configVars
+        self.instrument = None
+        self.acquisition_plan = None
+        self.is_connected = False
+        self.reconnect_count = 0
+        self.lost_sweeps = 0
+
+    def connect(self, reset: bool = None):
+        self.instrument, self.is_connected = establish_connection(configVars=self.config_vars, reset=reset)
+        return self.is_connected
+
+    def setup(self):
+        vna_measurement_setup(instrument=self.instrument, configVars=self.config_vars)
+        self.prepare_plan()
+        return
+
+    def prepare_plan(self):
+        self.acquisition_plan = prepare_acquisition_plan(instrument=self.instrument, configVars=self.config_vars)
+        return self.acquisition_plan
+
+    @INSTR.timed("vna.acquire")
+    def acquire(self, preArm: bool = False):
+        """
+        Acquires the VNA data of one sweep with `acquire_vna_data`, reconnecting if the connection was lost
+        Args:
+            preArm: Whether to start the next sweep at the end of this one. Only for readings taken back-to-back
+        Returns: The dict from `acquire_vna_data`, or `None` if the sweep was lost to a reconnection
+        """
+        try:
+            return acquire_vna_data(instrument=self.instrument, configVars=self.config_vars, acquisitionPlan=self.acquisition_plan, preArm=preArm)
+        except (pyvisa.errors.VisaIOError, RsInstrument.RsInstrException) as err:
+            # Errors reported by the instrument itself are not a connection problem
+            if isinstance(err, RsInstrument.StatusException):
+                raise
+            print(f"WARNING Lost the connection to the VNA: {err}")
+            self.lost_sweeps += 1
+            if not self.reconnect():
+                raise
+            return None
+
+    def reconnect(self):
+        """
+        Reattaches to the VNA without resetting it, waiting `VNA_RECONNECT_BACKOFF` seconds after the first failed attempt and twice as long after each one following it, up to `VNA_RECONNECT_BACKOFF_MAX`
+        Returns: (`bool`) Whether the session was restored within `VNA_RECONNECT_ATTEMPTS` attempts
+        """
+        self.close()
+        backoff = self.config_vars["VNA_RECONNECT_BACKOFF"]
+        for attempt in range(1, self.config_vars["VNA_RECONNECT_ATTEMPTS"] + 1):
+            print(f"NOTICE Reconnecting to the VNA, attempt {attempt} of {self.config_vars['VNA_RECONNECT_ATTEMPTS']}...")
+            try:
+                if self.connect(reset=False):
+                    self.setup()
+                    self.reconnect_count += 1
+                    print("SUCCESS Reconnected to the VNA")
+                    return True
+            except (pyvisa.errors.VisaIOError, RsInstrument.RsInstrException) as err:
+                print(f"WARNING Unable to set up the VNA after reconnecting: {err}")
+            if attempt < self.config_vars["VNA_RECONNECT_ATTEMPTS"]:
+                time.sleep(backoff)
+            backoff = min(backoff * 2, self.config_vars["VNA_RECONNECT_BACKOFF_MAX"])
+        self.is_connected = False
+        print("ERROR Unable to reconnect to the VNA")
+        return False
+
+    def close(self):
+        if self.instrument is not None and not isinstance(self.instrument, type):
+            try:
+                self.instrument.close()
+            except (pyvisa.errors.VisaIOError, RsInstrument.RsInstrException):
+                pass
+        self.is_connected = False
+        return
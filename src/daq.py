@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Data acquisition runs used by the data acquisition menu in main.py and by the campaign runner in campaign.py
+Reads the VNA and the Arduino concurrently so each cycle costs the slower of the two devices instead of their sum
+"""
+import concurrent.futures
+import datetime
+import time
+
+import src.calculate as TRACECALC
+import src.conn_arduino as ARDCONN
+import src.instrumentation as INSTR
+import src.live_view as LIVEVIEW
+import src.running_stats as RUNSTATS
+import src.rw_data as RWDATA
+import src.scheduler as SCHEDULER
+
+
+@INSTR.profiled
+def read_vna(vnaSession, preArm: bool):
+    start_time = time.monotonic()
+    vna_data = vnaSession.acquire(preArm=preArm)
+    return vna_data, start_time, time.monotonic()
+
+
+@INSTR.profiled
+def read_fsr(serialObject, lineReader, readDelay: float):
+    if readDelay > 0:
+        time.sleep(readDelay)
+    start_time = time.monotonic()
+    ard_results_res, ard_results_vol, ard_read_status = ARDCONN.get_FSR_res_and_vol(serialObject=serialObject, lineReader=lineReader)
+    return (ard_results_vol, ard_results_res, ard_read_status), start_time, time.monotonic()
+
+
+@INSTR.timed("daq.cycle")
+def acquire_cycle(executor: concurrent.futures.Executor, vnaSession, serialObject, configVars: dict,
+                  daqStartTime: float, fsrReadDelay: float = 0.0, lineReader=None, preArm: bool = False):
+    """
+    Runs one acquisition cycle with the VNA fetch and the FSR read in parallel
+    Args:
+        executor: An executor with at least two workers
+        vnaSession: The connected and set up `INSTCONN.VnaSession`
+        serialObject: The connected Arduino serial object
+        configVars: Configuration variables loaded from the configuration file
+        daqStartTime: The `time.monotonic()` value at the start of the run
+        fsrReadDelay: Seconds to wait before reading the FSR so that it is sampled mid-sweep. See `get_fsr_read_delay`
+        lineReader: The Arduino's running `ARDCONN.SerialLineReader`, if any
+        preArm: Whether to start the next VNA sweep in single sweep mode at the end of this cycle. Only for cycles run back-to-back, see `INSTCONN.acquire_vna_data`
+
+    Returns: A dict with `vna_data` (`None` if the sweep was lost to a VNA reconnection), `ard_results_vol`, `ard_results_res`, `ard_read_status`, `timestamp` (seconds since `daqStartTime` shared by both readings) and the `vna_duration` and `fsr_duration` of each device in seconds
+    """
+    vna_future = executor.submit(read_vna, vnaSession, preArm)
+    fsr_future = executor.submit(read_fsr, serialObject, lineReader, fsrReadDelay)
+
+    vna_data, vna_start, vna_stop = vna_future.result()
+    (ard_results_vol, ard_results_res, ard_read_status), fsr_start, fsr_stop = fsr_future.result()
+
+    # Both readings are stamped with the middle of the VNA fetch, which is where the FSR read is aimed
+    capture_time = (vna_start + vna_stop) / 2
+
+    cycle_data = {
+        "vna_data": vna_data,
+        "ard_results_vol": ard_results_vol,
+        "ard_results_res": ard_results_res,
+        "ard_read_status": ard_read_status,
+        "timestamp": capture_time - daqStartTime,
+        "vna_duration": vna_stop - vna_start,
+        "fsr_duration": fsr_stop - fsr_start
+    }
+    return cycle_data
+
+
+def get_fsr_read_delay(cycleData: dict, configVars: dict):
+    """
+    Estimates from the previous cycle how long to wait before the FSR read so that its middle falls on the middle of the VNA fetch
+    Args:
+        cycleData: The dict returned by `acquire_cycle` for the previous cycle
+        configVars: Configuration variables loaded from the configuration file
+
+    Returns: (`float`) The delay in seconds, 0 if alignment is disabled with `DAQ_ALIGN_FSR_TO_SWEEP`
+    """
+    if not configVars["DAQ_ALIGN_FSR_TO_SWEEP"]:
+        return 0.0
+    return max(0.0, (cycleData["vna_duration"] - cycleData["fsr_duration"]) / 2)
+
+
+def get_file_timestamp():
+    current_time_for_file_naming = datetime.datetime.now().timetuple()
+    return f"{current_time_for_file_naming[0]}{current_time_for_file_naming[1]}{current_time_for_file_naming[2]}{current_time_for_file_naming[3]}{current_time_for_file_naming[4]}{current_time_for_file_naming[5]}"
+
+
+def run_acquisition(vnaSession, serialObject, configVars: dict, cycles: int, cyclePeriod: float,
+                    fileSuffix: str = "", lineReader=None, continueCallback=None):
+    """
+    Takes `cycles` readings into a new results file, named from `OUTPUT_FILE_NAME`, `fileSuffix` and the current time
+    Args:
+        vnaSession: The connected and set up `INSTCONN.VnaSession`
+        serialObject: The connected Arduino serial object
+        configVars: Configuration variables loaded from the configuration file
+        cycles: The number of readings to take
+        cyclePeriod: Seconds from the start of one reading to the start of the next. Readings are taken back-to-back if 0
+        fileSuffix: Appended to the output file name, if any
+        lineReader: The Arduino's running `ARDCONN.SerialLineReader`, if any
+        continueCallback: Called after each reading when given. The run stops early if it returns `False`. Readings are not scheduled at `cyclePeriod` when given
+
+    Returns: (`int`, `bool`) The number of readings taken and whether all `cycles` of them were taken
+    """
+    # Initialise results save file
+    run_config = dict(configVars)
+    run_config["OUTPUT_FILE_NAME"] = configVars["OUTPUT_FILE_NAME"] + "-" + fileSuffix
+    # Stage timings of the run are saved next to the results file
+    recorder = INSTR.RunRecorder(captureMode=run_config["INSTRUMENTATION_CAPTURE"])
+    field_names = run_config["FIELD_NAMES"]
+    file_timestamp = get_file_timestamp()
+    # print("DEBUG file_timestamp", file_timestamp)
+    RWDATA.initialise_results_file(config_vars=run_config, field_names=field_names, timestamp=file_timestamp)
+    # Rows are streamed to the results file as they are taken
+    results_writer = RWDATA.open_results_stream(config_vars=run_config, field_names=field_names, timestamp=file_timestamp)
+    if results_writer is None:
+        return 0, False
+
+    write_buffer_default = {field_name: None for field_name in field_names}
+    write_single_buffer = dict(write_buffer_default)
+
+    # The VNA and the Arduino are read in parallel on two worker threads
+    daq_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    fsr_read_delay = 0.0
+    daq_cycle_count = 0
+    is_complete = False
+    # Statistics of the run so far, kept without re-reading the results
+    run_stats = RUNSTATS.AcquisitionStats(configVars=run_config)
+
+    # The live view window is drawn by its own process and never holds up a reading
+    live_view = None
+    if run_config["LIVE_VIEW_ENABLED"]:
+        live_view = LIVEVIEW.LiveView(startFreq=run_config["VNA_START_FREQ"], stopFreq=run_config["VNA_STOP_FREQ"],
+                                      points=run_config["VNA_POINTS"], title=run_config["OUTPUT_FILE_NAME"],
+                                      queueSize=run_config["LIVE_VIEW_QUEUE_SIZE"]).start()
+
+    if run_config["INSTRUMENTATION_ENABLED"]:
+        recorder.start()
+
+    # A VNA sweep is only started ahead of its reading when the readings follow each other straight away
+    is_back_to_back = continueCallback is None and cyclePeriod <= 0
+    daq_start_time = time.monotonic()
+    scheduler = SCHEDULER.FixedRateScheduler(period=cyclePeriod, startTime=daq_start_time)
+    try:
+        while daq_cycle_count < cycles:
+            # Start data acquisition process
+            cycle_data = acquire_cycle(executor=daq_executor, vnaSession=vnaSession, serialObject=serialObject,
+                                       configVars=run_config, daqStartTime=daq_start_time,
+                                       fsrReadDelay=fsr_read_delay, lineReader=lineReader, preArm=is_back_to_back)
+            # R&S VNA
+            vna_data = cycle_data["vna_data"]
+            if vna_data is None:
+                print("WARNING Reading skipped while the VNA reconnected. Taking it again")
+                continue
+            fsr_read_delay = get_fsr_read_delay(cycleData=cycle_data, configVars=run_config)
+            # print("DEBUG vna_data", vna_data)
+            # Arduino
+            ard_results_vol = cycle_data["ard_results_vol"]
+            ard_results_res = cycle_data["ard_results_res"]
+            ard_read_status = cycle_data["ard_read_status"]
+            # print("DEBUG ard_results_vol", ard_results_vol, "ard_results_res", ard_results_res, "ard_read_status:", ard_read_status)
+
+            data_timestamp = cycle_data["timestamp"]
+            print(f"NOTICE Reading {daq_cycle_count + 1} taken at timestamp", data_timestamp)
+            print(f"Arduino with status {ard_read_status} has data read: voltage = {ard_results_vol} and resistance = {ard_results_res}")
+
+            # Process trace data
+            #"Cutoff Mag / dB", "Bandwidth / MHz", "Q Factor at Cutoff Mag"
+            target_cutoff_mags = [-10, -6, -3]
+            processed_trace_results = TRACECALC.get_trace_analysis(target_cutoff_mags=target_cutoff_mags,
+                                                                   sweep_start_f=run_config["VNA_START_FREQ"],
+                                                                   sweep_stop_f=run_config["VNA_STOP_FREQ"],
+                                                                   trace_data=vna_data["trace_data"])
+
+            # Save to buffer
+            write_single_buffer[field_names[0]] = data_timestamp
+            write_single_buffer[field_names[1]] = run_config["VNA_POINTS"]
+            write_single_buffer[field_names[2]] = vna_data["min_pt_freq"]
+            write_single_buffer[field_names[3]] = vna_data["min_pt_mag"]
+            write_single_buffer[field_names[4]] = f'{vna_data["minpt_imp_real"]}+j{vna_data["minpt_imp_j"]}'
+            write_single_buffer[field_names[5]] = vna_data["trace_data"]
+            write_single_buffer[field_names[6]] = ard_results_res
+            write_single_buffer[field_names[7]] = ard_results_vol
+            write_single_buffer[field_names[8]] = processed_trace_results["cutoff_mag"]
+            write_single_buffer[field_names[9]] = processed_trace_results["bandwidth"]
+            write_single_buffer[field_names[10]] = processed_trace_results["q_factor"]
+            write_single_buffer[field_names[11]] = run_config["VNA_START_FREQ"]
+            write_single_buffer[field_names[12]] = run_config["VNA_STOP_FREQ"]
+            results_writer.write_row(write_single_buffer)
+            write_single_buffer.update(write_buffer_default)
+            daq_cycle_count += 1
+
+            resonance_step = run_stats.update(traceResults=processed_trace_results, ardResultsRes=ard_results_res)
+            if resonance_step is not None:
+                print(f"WARNING Resonance frequency stepped {resonance_step['direction']} from {resonance_step['baseline']:.3f} MHz to about {resonance_step['level']:.3f} MHz at reading {daq_cycle_count}")
+            if run_config["STATS_SUMMARY_EVERY"] > 0 and daq_cycle_count % run_config["STATS_SUMMARY_EVERY"] == 0:
+                print(f"STATS {daq_cycle_count} readings: {run_stats.get_summary_text()}")
+
+            if live_view is not None:
+                live_view.publish(traceData=vna_data["trace_data"], cutoffMag=processed_trace_results["cutoff_mag"],
+                                  resonanceFreq=processed_trace_results["resonance_freq"],
+                                  resonanceMag=processed_trace_results["resonance_mag"],
+                                  caption=f"Reading {daq_cycle_count}  BW {processed_trace_results['bandwidth']} MHz  Q {processed_trace_results['q_factor']}")
+
+            if continueCallback is not None:
+                if not continueCallback():
+                    break
+            elif daq_cycle_count < cycles:
+                with INSTR.span("daq.schedule_wait"):
+                    is_on_time = scheduler.wait_next()
+                if not is_on_time:
+                    print(f"WARNING Reading {daq_cycle_count} took longer than the cycle period of {cyclePeriod} s")
+        else:
+            is_complete = True
+            print("DAQ Data acqusition process complete")
+    except KeyboardInterrupt:
+        print("WARNING Data acquisition interrupted. Readings taken so far are kept")
+    finally:
+        results_writer.close()
+        daq_executor.shutdown()
+        if live_view is not None:
+            live_view.close()
+            print(f"DAQ {live_view.published_count} readings sent to the live view, {live_view.dropped_count} dropped while it caught up")
+        if run_config["INSTRUMENTATION_ENABLED"]:
+            recorder.stop()
+            # The lateness of the latest and the overrun scheduled cycles is kept so that the cadence of the run can be checked
+            schedule = None
+            if continueCallback is None and cyclePeriod > 0:
+                schedule = {"summary": scheduler.get_summary(), **scheduler.get_cycle_log()}
+            sidecar_path = recorder.write_sidecar(INSTR.get_sidecar_path(RWDATA.get_results_file_path(config_vars=run_config, timestamp=file_timestamp)),
+                                                  schedule=schedule)
+            print(f"DAQ Stage timings saved to {sidecar_path}")
+            print(recorder.get_summary_text())
+
+    if daq_cycle_count > 0:
+        print(f"DAQ Run statistics: {run_stats.get_summary_text()}")
+    if continueCallback is None and cyclePeriod > 0:
+        print(f"DAQ Cycle timing: {scheduler.get_summary_text()}")
+    return daq_cycle_count, is_complete
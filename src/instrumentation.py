@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-stage latency instrumentation of the data acquisition runs
+Stages are timed with named spans, e.g.
+
+    with INSTR.span("vna.trace_transfer"):
+        ...
+
+Whole functions can be timed with the `@INSTR.timed("calc.trace_analysis")` decorator.
+Spans cost next to nothing when no `RunRecorder` is active. While one is, each span's durations go into a bounded log-bucketed histogram, summarised per run as count, mean, p50, p95 and max in a JSON sidecar next to the results file.
+The recorder can also capture a cProfile profile or the tracemalloc allocation sites of the run, with `INSTRUMENTATION_CAPTURE` set to "cprofile" or "tracemalloc".
+A profile covers the thread that starts the recorder and every call of a function decorated with `@INSTR.profiled` in other threads, such as the device reads submitted to worker threads. The profiles of all threads are merged into one
+"""
+import cProfile
+import functools
+import json
+import math
+import pathlib
+import pstats
+import threading
+import time
+import tracemalloc
+
+# Histogram buckets per doubling of the duration, i.e. a resolution of about 9%
+BUCKETS_PER_OCTAVE = 8
+
+CAPTURE_MODES = ("none", "cprofile", "tracemalloc")
+
+# The number of allocation sites kept from a tracemalloc capture
+TRACEMALLOC_TOP_SITES = 25
+
+# The recorder that spans are recorded to, if any
+_ACTIVE_RECORDER = None
+
+
+class LatencyHistogram:
+    """
+    Counts durations in nanoseconds in logarithmic buckets. Memory stays bounded however long the run is, and percentiles are accurate to the bucket width
+    """
+
+    def __init__(self):
+        self.buckets = dict()
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    def add(self, duration: int):
+        bucket = int(math.log2(duration) * BUCKETS_PER_OCTAVE) if duration > 1 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+
+    def get_percentile(self, percentile: float):
+        """
+        Returns: (`float`) The duration in nanoseconds below which `percentile` % of the durations fall, at the geometric middle of its bucket
+        """
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(percentile / 100 * self.count)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(pow(2, (bucket + 0.5) / BUCKETS_PER_OCTAVE), self.maximum)
+        return float(self.maximum)
+
+    def get_summary(self):
+        """
+        Returns: (`dict`) The `count` and the `mean_ms`, `p50_ms`, `p95_ms` and `max_ms` durations
+        """
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count / 1e6 if self.count else 0.0,
+            "p50_ms": self.get_percentile(50) / 1e6,
+            "p95_ms": self.get_percentile(95) / 1e6,
+            "max_ms": self.maximum / 1e6
+        }
+
+
+class _Span:
+    __slots__ = ("recorder", "name", "start")
+
+    def __init__(self, recorder, name: str):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.recorder.record(self.name, time.perf_counter_ns() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    """
+    Times the `with` block under `name` if a recorder is active
+    Args:
+        name: The stage name, prefixed with its subsystem, e.g. "vna.marker_query"
+    """
+    recorder = _ACTIVE_RECORDER
+    if recorder is None:
+        return _NULL_SPAN
+    return _Span(recorder, name)
+
+
+def timed(name: str):
+    """
+    Decorates a function so that each call is timed as a span under `name`
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profiled(function):
+    """
+    Decorates a function that runs in a worker thread so that its calls are included in a "cprofile" capture
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        recorder = _ACTIVE_RECORDER
+        profiler = recorder.get_thread_profiler() if recorder is not None else None
+        if profiler is None:
+            return function(*args, **kwargs)
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12 and later allow one active profiler at a time
+            recorder.profiled_thread_errors += 1
+            return function(*args, **kwargs)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.disable()
+    return wrapper
+
+
+def get_sidecar_path(results_file_path: pathlib.Path):
+    return pathlib.Path(results_file_path).with_suffix(".timing.json")
+
+
+class RunRecorder:
+    """
+    Collects the spans of one run. Spans are recorded from any thread while the recorder is started
+    """
+
+    def __init__(self, captureMode: str = "none"):
+        if captureMode not in CAPTURE_MODES:
+            raise ValueError(f"Unknown capture mode {captureMode}. Use one of {CAPTURE_MODES}")
+        self.capture_mode = captureMode
+        self.histograms = dict()
+        self.started_at = None
+        self.duration = 0.0
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._profiler_thread = None
+        self._thread_profilers = dict()
+        self.profiled_thread_errors = 0
+        self._tracemalloc_snapshot = None
+        self._tracemalloc_peak = 0
+
+    def record(self, name: str, duration: int):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.add(duration)
+
+    def get_thread_profiler(self):
+        """
+        Returns: (`cProfile.Profile`) The profiler of the calling thread for a "cprofile" capture, or `None` if there is none to enable, as for the thread that started the recorder
+        """
+        if self._profiler is None or threading.get_ident() == self._profiler_thread:
+            return None
+        with self._lock:
+            profiler = self._thread_profilers.get(threading.get_ident())
+            if profiler is None:
+                profiler = self._thread_profilers[threading.get_ident()] = cProfile.Profile()
+        return profiler
+
+    def start(self):
+        global _ACTIVE_RECORDER
+        if self.capture_mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler_thread = threading.get_ident()
+            self._profiler.enable()
+        elif self.capture_mode == "tracemalloc":
+            tracemalloc.start()
+        self.started_at = time.monotonic()
+        _ACTIVE_RECORDER = self
+        return self
+
+    def stop(self):
+        global _ACTIVE_RECORDER
+        if _ACTIVE_RECORDER is self:
+            _ACTIVE_RECORDER = None
+        self.duration = time.monotonic() - self.started_at
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self.capture_mode == "tracemalloc" and tracemalloc.is_tracing():
+            self._tracemalloc_snapshot = tracemalloc.take_snapshot()
+            self._tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_summary(self):
+        """
+        Returns: (`dict`) The histogram summary of every span name, see `LatencyHistogram.get_summary`
+        """
+        with self._lock:
+            return {name: histogram.get_summary() for name, histogram in sorted(self.histograms.items())}
+
+    def get_summary_text(self):
+        return "\n".join(f"{name:<24} n={summary['count']:<6} p50 {summary['p50_ms']:9.3f} ms  p95 {summary['p95_ms']:9.3f} ms  max {summary['max_ms']:9.3f} ms"
+                         for name, summary in self.get_summary().items())
+
+    def write_sidecar(self, file_path: pathlib.Path, schedule: dict = None):
+        """
+        Writes the span summary as JSON, along with the capture if any. A cProfile capture is written to a ".prof" file next to it for `pstats` or snakeviz
+        Args:
+            file_path: The path of the sidecar file, see `get_sidecar_path`
+            schedule: The cycle schedule of the run, if it had one, saved under "schedule"
+        Returns: (`pathlib.Path`) The path of the sidecar file
+        """
+        file_path = pathlib.Path(file_path)
+        sidecar = {
+            "run_duration_s": self.duration,
+            "buckets_per_octave": BUCKETS_PER_OCTAVE,
+            "capture_mode": self.capture_mode,
+            "spans": self.get_summary()
+        }
+        if schedule is not None:
+            sidecar["schedule"] = schedule
+        if self._profiler is not None:
+            profile_path = file_path.with_suffix(".prof")
+            stats = pstats.Stats(self._profiler)
+            with self._lock:
+                thread_profilers = list(self._thread_profilers.values())
+            for profiler in thread_profilers:
+                stats.add(profiler)
+            stats.dump_stats(profile_path)
+            sidecar["cprofile_file"] = profile_path.name
+            sidecar["cprofile_threads"] = 1 + len(thread_profilers)
+            if self.profiled_thread_errors:
+                sidecar["cprofile_unprofiled_calls"] = self.profiled_thread_errors
+        if self._tracemalloc_snapshot is not None:
+            sidecar["tracemalloc_peak_bytes"] = self._tracemalloc_peak
+            sidecar["tracemalloc_top_sites"] = [
+                {"site": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                for stat in self._tracemalloc_snapshot.statistics("lineno")[:TRACEMALLOC_TOP_SITES]
+            ]
+        with open(file_path, "w") as file:
+            json.dump(sidecar, file, indent=2)
+        return file_path
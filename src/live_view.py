@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Live view of the S11 trace during a data acquisition run
+The window is drawn by its own process, so drawing never holds up the acquisition loop. Each reading is sent to it as a frame through a short queue and dropped if the window has fallen behind.
+The axes, grid and labels are drawn once. Each frame only updates the trace line, the cut-off line, the resonance marker and the caption in place with `set_ydata` and blits them over the saved background
+"""
+import multiprocessing
+import queue
+import time
+
+# Seconds the window waits for a frame before handling its own events
+FRAME_POLL_INTERVAL = 0.02
+# Seconds a closing run waits for the window process to finish
+CLOSE_TIMEOUT = 2.0
+# Headroom in dB kept above and below the trace when the magnitude axis is rescaled
+MAG_MARGIN = 2.0
+
+
+class LiveView:
+    """
+    The parent side of the live view window. Frames are sent with `publish`, which never blocks
+    """
+
+    def __init__(self, startFreq: float, stopFreq: float, points: int, title: str = "", queueSize: int = 2):
+        self.start_freq = startFreq
+        self.stop_freq = stopFreq
+        self.points = points
+        self.title = title
+        self.published_count = 0
+        self.dropped_count = 0
+        # A fresh interpreter, rather than a fork of the threads of the acquisition process
+        self._context = multiprocessing.get_context("spawn")
+        self._queue = self._context.Queue(maxsize=queueSize)
+        self._process = None
+
+    def start(self):
+        self._process = self._context.Process(target=run_view, name="live-view", daemon=True,
+                                              args=(self._queue, self.start_freq, self.stop_freq, self.points, self.title))
+        self._process.start()
+        return self
+
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def publish(self, traceData, cutoffMag: float, resonanceFreq: float, resonanceMag: float, caption: str = ""):
+        """
+        Sends a reading to the window, or drops it if the window has not caught up with the frames already sent
+        Returns: (`bool`) Whether the frame was queued
+        """
+        try:
+            self._queue.put_nowait({"trace": traceData, "cutoff": cutoffMag, "mfreq": resonanceFreq,
+                                    "mmag": resonanceMag, "caption": caption})
+        except queue.Full:
+            self.dropped_count += 1
+            return False
+        self.published_count += 1
+        return True
+
+    def close(self):
+        """
+        Closes the window and waits for its process to finish
+        """
+        if self._process is None:
+            return
+        try:
+            self._queue.put(None, timeout=CLOSE_TIMEOUT)
+        except queue.Full:
+            pass
+        self._process.join(timeout=CLOSE_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._queue.close()
+        self._process = None
+        return
+
+
+def get_latest_frame(frameQueue):
+    """
+    Waits briefly for a frame and then takes any newer ones, so that the window always shows the latest reading
+    Returns: (`dict`) The latest frame, `None` if the run has ended, or `False` if no frame came
+    """
+    try:
+        frame = frameQueue.get(timeout=FRAME_POLL_INTERVAL)
+    except queue.Empty:
+        return False
+    while frame is not None:
+        try:
+            frame = frameQueue.get_nowait()
+        except queue.Empty:
+            break
+    return frame
+
+
+def run_view(frameQueue, startFreq: float, stopFreq: float, points: int, title: str):
+    """
+    The window process. Draws frames from `frameQueue` until it receives `None` or the window is closed
+    """
+    import numpy
+    import matplotlib.pyplot as plt
+
+    figure, axes = plt.subplots()
+    figure.canvas.manager.set_window_title(f"Live view {title}".strip())
+    trace_freq = numpy.linspace(startFreq, stopFreq, points)
+    blank_trace = numpy.full(points, numpy.nan)
+    axes.set_xlim(startFreq, stopFreq)
+    axes.set_ylim(-30.0, 0.0)
+    axes.set_xlabel("Frequency in MHz")
+    axes.set_ylabel("Magnitude in dB")
+    axes.grid(True)
+
+    # Animated artists are left out of the background and drawn by hand each frame
+    (trace_line,) = axes.plot(trace_freq, blank_trace, label="S11", color="m", animated=True)
+    (cutoff_line,) = axes.plot(trace_freq, blank_trace, label="Cut-off", color="g", alpha=0.5, animated=True)
+    (marker,) = axes.plot([numpy.nan], [numpy.nan], marker="+", markersize=12, color="r", animated=True)
+    caption = axes.text(0.02, 0.02, "", transform=axes.transAxes, animated=True)
+    axes.legend(loc="upper right")
+    animated_artists = (trace_line, cutoff_line, marker, caption)
+
+    state = {"background": None, "is_open": True}
+
+    def on_draw(event):
+        # The background changes whenever the window is resized or redrawn
+        state["background"] = figure.canvas.copy_from_bbox(figure.bbox)
+        for artist in animated_artists:
+            axes.draw_artist(artist)
+
+    def on_close(event):
+        state["is_open"] = False
+
+    figure.canvas.mpl_connect("draw_event", on_draw)
+    figure.canvas.mpl_connect("close_event", on_close)
+    plt.show(block=False)
+    figure.canvas.draw()
+
+    cutoff_trace = numpy.empty(points)
+    frame_count = 0
+    first_frame_time = None
+    while state["is_open"]:
+        frame = get_latest_frame(frameQueue)
+        if frame is None:
+            break
+        if frame is False:
+            figure.canvas.flush_events()
+            continue
+
+        trace = numpy.asarray(frame["trace"], dtype=numpy.float64)
+        if trace.size != points:
+            continue
+        trace_line.set_ydata(trace)
+        cutoff_trace.fill(frame["cutoff"] if frame["cutoff"] is not None else numpy.nan)
+        cutoff_line.set_ydata(cutoff_trace)
+        marker.set_data([frame["mfreq"]], [frame["mmag"]])
+        caption.set_text(frame["caption"])
+
+        # The axes are only redrawn when the trace leaves the magnitude range
+        low, high = axes.get_ylim()
+        trace_min, trace_max = numpy.nanmin(trace), numpy.nanmax(trace)
+        if trace_min < low or trace_max > high:
+            axes.set_ylim(min(low, trace_min - MAG_MARGIN), max(high, trace_max + MAG_MARGIN))
+            figure.canvas.draw()
+        else:
+            figure.canvas.restore_region(state["background"])
+            for artist in animated_artists:
+                axes.draw_artist(artist)
+            figure.canvas.blit(figure.bbox)
+        figure.canvas.flush_events()
+
+        frame_count += 1
+        if first_frame_time is None:
+            first_frame_time = time.monotonic()
+
+    if frame_count > 1:
+        print(f"LIVE VIEW {frame_count} frames drawn at {(frame_count - 1) / (time.monotonic() - first_frame_time):.1f} frames/s")
+    plt.close(figure)
+    return
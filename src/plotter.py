@@ -5,16 +5,32 @@ Created on Wed Jun 14 2023
 
 @author: elviskasonlin
 """
+from __future__ import annotations
 
 import src.rw_data as RWDATA
 import src.aux_fns as AUXFN
 import src.calculate as CALC
+import concurrent.futures
+import hashlib
+import json
+import os
 import pathlib
 import operator
 import numpy
-import scipy
-import matplotlib.pyplot as plt
-from ast import literal_eval
+from typing import TYPE_CHECKING
+
+# matplotlib is only loaded once a plot is drawn, see `new_figure`
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+# One figure per worker process, reused for every row it renders
+_WORKER_FIGURE = None
+
+# Settings that change how a row is drawn. Changing them invalidates the render manifest
+PLOT_PARAMS = {"format": "png", "detail_minimum_threshold": 1000, "detail_factor": 3, "version": 1}
+RENDER_MANIFEST_NAME = "render-manifest.json"
+# Seconds a trace store may be older than its results file, as the two are closed one after the other
+TRACE_STORE_MTIME_TOLERANCE = 2.0
 
 
 def engage_plotter(config_vars: dict):
@@ -35,87 +51,235 @@ def engage_plotter(config_vars: dict):
     # Continue soling the no data issue
     choice_file_path = files[choice-1]
     print(f"You have chosen the following file path: {choice_file_path}")
-    read_status, file_data = RWDATA.read_operation(file_path=choice_file_path, field_names=config_vars["FIELD_NAMES"])
-    #print("DEBUG", "plotter read_status:", read_status, ", plotter file_data:", file_data)
-
-    field_name_points = config_vars["FIELD_NAMES"][1]
-    field_name_min_freq = config_vars["FIELD_NAMES"][2]
-    field_name_min_mag = config_vars["FIELD_NAMES"][3]
-    field_name_min_imp = config_vars["FIELD_NAMES"][4]
-    field_name_trace_data = config_vars["FIELD_NAMES"][5]
-    field_name_cutoff_mag = config_vars["FIELD_NAMES"][8]
-    field_name_cutoff_bw = config_vars["FIELD_NAMES"][9]
-    field_name_cutoff_qfactor = config_vars["FIELD_NAMES"][10]
-    field_name_startf = config_vars["FIELD_NAMES"][11]
-    field_name_stopf = config_vars["FIELD_NAMES"][12]
-
-    extracted_data = list()
-    for idx, row in enumerate(file_data):
-        if idx != 0:
-            write_buffer_dict = {"startf": literal_eval(row[field_name_startf]),
-                                 "stopf": literal_eval(row[field_name_stopf]),
-                                 "pts": literal_eval(row[field_name_points]),
-                                 "cutoff": literal_eval(row[field_name_cutoff_mag]),
-                                 "bw": literal_eval(row[field_name_cutoff_bw]),
-                                 "qfactor": literal_eval(row[field_name_cutoff_qfactor]),
-                                 "mfreq": literal_eval(row[field_name_min_freq]),
-                                 "mmag": literal_eval(row[field_name_min_mag]),
-                                 "mimp": row[field_name_min_imp],
-                                 "trace": literal_eval(row[field_name_trace_data])}
-            extracted_data.append(write_buffer_dict)
+    # Runs saved with the "npy" output format keep their traces in a memory-mapped trace store
+    traces = load_trace_store(results_file_path=choice_file_path)
 
-    # print("DEBUG", f"minpt_list data: {minpt_list}")
+    field_names = config_vars["FIELD_NAMES"]
 
-    # Plot and Save Graphs
     # Save location
     parent_folder_name = config_vars["OUTPUT_FOLDER"]
+    dir_location = pathlib.Path.cwd().joinpath(f"{parent_folder_name}/images/{choice}")
+    RWDATA.make_dir(folder_path=dir_location)
+
+    def get_image_path(idx: int):
+        return dir_location.joinpath(f"{choice}-row_{idx}.{PLOT_PARAMS['format']}")
+
+    # Only rows that are new or changed since the last render need plotting
+    row_digests = get_row_digests(file_path=choice_file_path, traces=traces)
+    render_manifest = load_render_manifest(dir_location=dir_location)
+    previous_digests = dict()
+    if render_manifest.get("source") == choice_file_path.name and render_manifest.get("params") == PLOT_PARAMS:
+        previous_digests = render_manifest["rows"]
+    rows_to_render = {idx for idx, digest in enumerate(row_digests)
+                      if previous_digests.get(str(idx)) != digest or not get_image_path(idx).exists()}
+    print(f"PLOTTER {len(row_digests) - len(rows_to_render)} of {len(row_digests)} plots are up to date")
+
+    def extract_rows():
+        # Rows are read and parsed one at a time as the renderer asks for them
+        row_iterator = RWDATA.iter_results(file_path=choice_file_path, field_names=field_names, row_filter=rows_to_render.__contains__)
+        for idx, row in enumerate(row_iterator):
+            if row is None:
+                continue
+            write_buffer_dict = {"startf": row[field_names[11]],
+                                 "stopf": row[field_names[12]],
+                                 "pts": row[field_names[1]],
+                                 "cutoff": row[field_names[8]],
+                                 "bw": row[field_names[9]],
+                                 "qfactor": row[field_names[10]],
+                                 "mfreq": row[field_names[2]],
+                                 "mmag": row[field_names[3]],
+                                 "mimp": row[field_names[4]],
+                                 "trace": row[field_names[5]] if traces is None else numpy.asarray(traces[idx])}
+            yield idx, write_buffer_dict
+
+    # print("DEBUG", f"minpt_list data: {minpt_list}")
+
+    # Plot and Save Graphs
+    render_jobs = ((val, idx, get_image_path(idx)) for idx, val in extract_rows())
+    saved_rows = render_plots(render_jobs=render_jobs, job_count=len(rows_to_render), worker_count=config_vars["PLOTTER_WORKERS"])
+
+    # Drop images of rows that failed to render or no longer exist, then record what is now on disk
+    current_digests = dict()
+    for idx, digest in enumerate(row_digests):
+        if idx not in rows_to_render or idx in saved_rows:
+            current_digests[str(idx)] = digest
+        else:
+            get_image_path(idx).unlink(missing_ok=True)
+    for image_path in dir_location.glob(f"{choice}-row_*.{PLOT_PARAMS['format']}"):
+        if image_path.stem.rsplit("_", 1)[-1] not in current_digests:
+            image_path.unlink()
+    save_render_manifest(dir_location=dir_location, render_manifest={"source": choice_file_path.name, "params": PLOT_PARAMS, "rows": current_digests})
+
+
+def load_trace_store(results_file_path: pathlib.Path):
+    """
+    Opens the trace store of a results file if it belongs to it, i.e. it is not older than the results file and has a trace for every row
+    Returns: (`numpy.ndarray`) The memory-mapped traces, or `None` if there is no trace store or it does not match, in which case the traces in the results file are used
+    """
+    trace_store_path = RWDATA.get_trace_store_path(results_file_path=results_file_path)
+    if not trace_store_path.exists():
+        return None
+    if trace_store_path.stat().st_mtime < results_file_path.stat().st_mtime - TRACE_STORE_MTIME_TOLERANCE:
+        print(f"WARNING Trace store {trace_store_path.name} is older than its results file. Using the traces in the results file instead")
+        return None
+    traces = RWDATA.read_traces(file_path=trace_store_path)
+    row_count = sum(1 for _ in RWDATA.iter_raw_rows(file_path=results_file_path))
+    if len(traces) != row_count:
+        print(f"WARNING Trace store {trace_store_path.name} has {len(traces)} traces for {row_count} rows. Using the traces in the results file instead")
+        return None
+    return traces
+
+
+def get_row_digests(file_path: pathlib.Path, traces):
+    """
+    Hashes each data row of a results file, including its trace from the trace store if there is one
+    Returns: (`list`) A hex digest per row
+    """
+    row_digests = list()
+    for idx, line in enumerate(RWDATA.iter_raw_rows(file_path=file_path)):
+        digest = hashlib.blake2b(line, digest_size=16)
+        if traces is not None:
+            digest.update(traces[idx].tobytes())
+        row_digests.append(digest.hexdigest())
+    return row_digests
+
+
+def load_render_manifest(dir_location: pathlib.Path):
+    """
+    Loads the render manifest of an image folder
+    Returns: (`dict`) The manifest with `source`, `params` and `rows` (row index to digest), or an empty dict if there is none
+    """
+    try:
+        with open(dir_location.joinpath(RENDER_MANIFEST_NAME), "r") as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return dict()
+
+
+def save_render_manifest(dir_location: pathlib.Path, render_manifest: dict):
+    # Written to a temporary file first so an interrupted save cannot leave a corrupt manifest
+    manifest_path = dir_location.joinpath(RENDER_MANIFEST_NAME)
+    temporary_path = manifest_path.with_suffix(".tmp")
+    with open(temporary_path, "w") as manifest_file:
+        json.dump(render_manifest, manifest_file)
+    os.replace(temporary_path, manifest_path)
+
+
+def render_plots(render_jobs, job_count: int, worker_count: int):
+    """
+    Renders and saves plots across a pool of worker processes, printing progress as each one completes
+    Args:
+        render_jobs: An iterable of (data, index, file_path) tuples, with data as expected by `plot_graph`. Consumed lazily
+        job_count: The number of jobs in `render_jobs`
+        worker_count: The number of worker processes. 0 uses one per CPU core
+
+    Returns: (`set`) The indices of the plots saved
+    """
+    saved_rows = set()
+    if job_count == 0:
+        return saved_rows
+    worker_count = min(worker_count if worker_count > 0 else (os.cpu_count() or 1), job_count)
+    print(f"PLOTTER Rendering {job_count} plots with {worker_count} worker(s)...")
+
+    done_count = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=worker_count) as executor:
+        # Only a few jobs per worker are in flight at a time to keep memory bounded
+        pending_jobs = iter(render_jobs)
+        in_flight = set()
+        while True:
+            while len(in_flight) < worker_count * 4:
+                job = next(pending_jobs, None)
+                if job is None:
+                    break
+                in_flight.add(executor.submit(render_plot, *job))
+            if not in_flight:
+                break
+            finished, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                done_count += 1
+                index, error = future.result()
+                if error is None:
+                    saved_rows.add(index)
+                else:
+                    print(f"ERROR Unable to plot row {index}: {error}")
+                print(f"PLOTTER Progress {done_count}/{job_count}")
+    return saved_rows
+
+
+def render_plot(data: dict, index: int, file_path: pathlib.Path):
+    """
+    Worker entry point that plots a row on the worker's figure and saves it as a PNG
+    Returns: (`int`, `str`) The row index and the error message, which is `None` on success
+    """
+    global _WORKER_FIGURE
+    if _WORKER_FIGURE is None:
+        _WORKER_FIGURE = new_figure()
+    try:
+        figure = plot_graph(data=data, index=index, figure=_WORKER_FIGURE)
+        figure.savefig(fname=file_path, dpi='figure', format=PLOT_PARAMS["format"], metadata=None,
+                       bbox_inches=None, pad_inches=0.1,
+                       facecolor='auto', edgecolor='auto',
+                       backend=None)
+    except Exception as err:
+        return index, str(err)
+    return index, None
+
+
+def new_figure():
+    """
+    Returns: (`Figure`) A new figure drawn with the Agg backend, independent of pyplot
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    return figure
 
-    for idx, val in enumerate(extracted_data):
-        plot = plot_graph(data=val, index=idx)
-        #plot.show()
-        format = "png"
-        dir_location = pathlib.Path.cwd().joinpath(f"{parent_folder_name}/images/{choice}")
-        RWDATA.make_dir(folder_path=dir_location)
-        file_path = dir_location.joinpath(f"{choice}-row_{idx}.{format}")
-        plot.savefig(fname=file_path, dpi='figure', format=format, metadata=None,
-                    bbox_inches=None, pad_inches=0.1,
-                    facecolor='auto', edgecolor='auto',
-                    backend=None)
-        plot.clf()
 
+def plot_graph(data: dict, index: int, figure: Figure = None):
+    """
+    Plots a row's trace, cut-off line, minimum point and cut-off intersections on an Agg figure
+    Args:
+        data: The row as extracted by `engage_plotter`
+        index: The row index
+        figure: The figure to draw on. It is cleared first. A new one is created if not given
 
-def plot_graph(data: dict, index: int):
+    Returns: (`Figure`) The figure
+    """
+    if figure is None:
+        figure = new_figure()
+    figure.clf()
+    axes = figure.add_subplot()
 
     sweep_start_f = data["startf"]
     sweep_stop_f = data["stopf"]
-    sweep_range = sweep_stop_f - sweep_start_f
 
     target_cutoff_mag = data["cutoff"]
     trace_point_count = len(data["trace"])
-    trace_point_delta = sweep_range / (trace_point_count - 1)
 
     # Logic for whether to use a detailed trace
-    detail_minimum_threshold = 1000
-    detail_factor = 3
+    detail_minimum_threshold = PLOT_PARAMS["detail_minimum_threshold"]
+    detail_factor = PLOT_PARAMS["detail_factor"]
     detailed_trace_point_count = trace_point_count
     if trace_point_count < detail_minimum_threshold:
         detailed_trace_point_count = int(trace_point_count * detail_factor)
 
     # Setting up settings for trace
-    corresponding_trace_freq = [idx*trace_point_delta+sweep_start_f for idx in range(0, trace_point_count)]
-    cutoff_mag_trace = [target_cutoff_mag for idx in range(0, detailed_trace_point_count)]
+    corresponding_trace_freq = CALC.get_frequency_axis(float(sweep_start_f), float(sweep_stop_f), trace_point_count)
+    cutoff_mag_trace = numpy.full(detailed_trace_point_count, target_cutoff_mag, dtype=numpy.float64)
 
-    # Create an interpolated trace using scipy interpolate
-    interpolated_trace = scipy.interpolate.interp1d(corresponding_trace_freq, data["trace"])
+    # Linear interpolation of the trace
+    def interpolated_trace(x):
+        return numpy.interp(x, corresponding_trace_freq, data["trace"])
 
     # Generate a detailed trace using the interpolated trace function
     detailed_trace_freq = numpy.linspace(start=sweep_start_f, stop=sweep_stop_f, endpoint=True, num=detailed_trace_point_count)
-    detailed_trace_mag = [interpolated_trace(x) for x in detailed_trace_freq]
+    detailed_trace_mag = interpolated_trace(detailed_trace_freq)
 
     # Check for intersection points
     intersection_points = list(CALC.intersect(x=numpy.asarray(detailed_trace_freq), f=numpy.asarray(detailed_trace_mag),
                                               g=numpy.asarray(cutoff_mag_trace)))
-    print("DEBUG intersection_points:", intersection_points)
+    # print("DEBUG intersection_points:", intersection_points)
     # Get the nearest intersection points
 
     # Get the distance of intersect points to the minimum point and save as a dictionary
@@ -152,19 +316,18 @@ def plot_graph(data: dict, index: int):
     #print("DEBUG Point count:", len(detailed_trace_mag), len(detailed_trace_freq))
 
     # Continue with the actual plotting function here
-    plt.xlabel("Frequency in MHz")
-    plt.ylabel("Magnitude in dB")
-    plt.grid()
-    plt.text(x=data["mfreq"]+5,y=interpolated_trace(data["mfreq"])+0.5,
-             s=f"{data['mfreq']} MHz\n{interpolated_trace(data['mfreq'])} dB\n{data['mimp']}\n BW: {round(data['bw'], 3)}, Q: {round(data['qfactor'], 3)}",
-             horizontalalignment="left")
-    plt.plot(detailed_trace_freq, detailed_trace_mag, label='Interpolated', color="m", alpha=0.5)
-    plt.plot(detailed_trace_freq, cutoff_mag_trace, label='Cut-off', color="g", alpha=0.5)
-    plt.plot(data["mfreq"], interpolated_trace(data["mfreq"]), marker="+")
-    print("Error?", is_error_intersect_pts_finder)
+    axes.set_xlabel("Frequency in MHz")
+    axes.set_ylabel("Magnitude in dB")
+    axes.grid()
+    axes.text(x=data["mfreq"]+5,y=interpolated_trace(data["mfreq"])+0.5,
+              s=f"{data['mfreq']} MHz\n{interpolated_trace(data['mfreq'])} dB\n{data['mimp']}\n BW: {round(data['bw'], 3)}, Q: {round(data['qfactor'], 3)}",
+              horizontalalignment="left")
+    axes.plot(detailed_trace_freq, detailed_trace_mag, label='Interpolated', color="m", alpha=0.5)
+    axes.plot(detailed_trace_freq, cutoff_mag_trace, label='Cut-off', color="g", alpha=0.5)
+    axes.plot(data["mfreq"], interpolated_trace(data["mfreq"]), marker="+")
+    # print("DEBUG Error?", is_error_intersect_pts_finder)
     if not is_error_intersect_pts_finder:
-        plt.plot(sorted_closest_intersect_points_by_f[0]["freq"], sorted_closest_intersect_points_by_f[0]["mag"], marker="x", color="r")
-        plt.plot(sorted_closest_intersect_points_by_f[1]["freq"], sorted_closest_intersect_points_by_f[1]["mag"], marker="x", color="r")
-    plt.legend()
-    # plt.show()
-    return plt
\ No newline at end of file
+        axes.plot(sorted_closest_intersect_points_by_f[0]["freq"], sorted_closest_intersect_points_by_f[0]["mag"], marker="x", color="r")
+        axes.plot(sorted_closest_intersect_points_by_f[1]["freq"], sorted_closest_intersect_points_by_f[1]["mag"], marker="x", color="r")
+    axes.legend()
+    return figure
\ No newline at end of file
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Running statistics of a data acquisition run, updated one reading at a time
+Keeps the mean, variance, minimum and maximum of each tracked quantity in constant memory with Welford's algorithm, and watches the resonance frequency for step changes with a two-sided CUSUM detector
+"""
+import math
+
+
+class RunningStats:
+    """
+    Welford's online mean and variance, with the minimum and maximum. Values of `None` or NaN are not counted
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value):
+        if value is None or math.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def get_variance(self):
+        # Sample variance
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def get_std(self):
+        return math.sqrt(self.get_variance())
+
+    def get_summary(self):
+        """
+        Returns: (`dict`) The `count`, `mean`, `std`, `min` and `max`, with `None` for all but the count if nothing was counted
+        """
+        if self.count == 0:
+            return {"count": 0, "mean": None, "std": None, "min": None, "max": None}
+        return {"count": self.count, "mean": self.mean, "std": self.get_std(), "min": self.minimum, "max": self.maximum}
+
+
+class DriftDetector:
+    """
+    Detects step changes in a reading with a two-sided CUSUM on readings standardised against a baseline.
+    The baseline mean and standard deviation are taken from the first `warmupReadings` readings, and again after each detected step. The standard deviation is at least `minSigma` so that a very steady baseline does not flag every small change.
+    A step is flagged when either cumulative sum of the standardised deviations, each less the allowance `k`, exceeds the threshold `h`. An EWMA of the readings with weight `alpha` is kept as the current level
+    """
+
+    def __init__(self, warmupReadings: int = 20, k: float = 0.5, h: float = 5.0, alpha: float = 0.2, minSigma: float = 0.0):
+        self.warmup_readings = int(warmupReadings)
+        self.k = float(k)
+        self.h = float(h)
+        self.alpha = float(alpha)
+        self.min_sigma = float(minSigma)
+        self.ewma = None
+        self.step_count = 0
+        self._baseline = RunningStats()
+        self._baseline_mean = None
+        self._baseline_sigma = None
+        self._cusum_high = 0.0
+        self._cusum_low = 0.0
+
+    def is_warming_up(self):
+        return self._baseline_mean is None
+
+    def add(self, value):
+        """
+        Adds a reading. `None` or NaN readings are ignored
+        Returns: (`dict`) `None` unless a step change was detected, in which case the `direction` ("up" or "down"), the `baseline` it moved from and the `level` it moved to
+        """
+        if value is None or math.isnan(value):
+            return None
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+
+        if self.is_warming_up():
+            self._baseline.add(value)
+            if self._baseline.count >= self.warmup_readings:
+                self._baseline_mean = self._baseline.mean
+                self._baseline_sigma = max(self._baseline.get_std(), self.min_sigma)
+            return None
+
+        deviation = (value - self._baseline_mean) / self._baseline_sigma if self._baseline_sigma > 0 else 0.0
+        self._cusum_high = max(0.0, self._cusum_high + deviation - self.k)
+        self._cusum_low = max(0.0, self._cusum_low - deviation - self.k)
+        if self._cusum_high <= self.h and self._cusum_low <= self.h:
+            return None
+
+        step = {"direction": "up" if self._cusum_high > self.h else "down", "baseline": self._baseline_mean, "level": self.ewma}
+        self.step_count += 1
+        self._restart()
+        return step
+
+    def _restart(self):
+        # A new baseline is taken at the new level
+        self._baseline = RunningStats()
+        self._baseline_mean = None
+        self._baseline_sigma = None
+        self._cusum_high = 0.0
+        self._cusum_low = 0.0
+
+
+class AcquisitionStats:
+    """
+    The running statistics of the resonance frequency, bandwidth, Q factor and both FSR resistances over a run, and the resonance frequency drift detector
+    """
+
+    QUANTITIES = ("resonance_freq", "bandwidth", "q_factor", "fsr_res_inner", "fsr_res_outer")
+
+    def __init__(self, configVars: dict):
+        self.stats = {quantity: RunningStats() for quantity in self.QUANTITIES}
+        self.drift_detector = DriftDetector(warmupReadings=configVars["DRIFT_WARMUP_READINGS"], k=configVars["DRIFT_CUSUM_K"],
+                                            h=configVars["DRIFT_CUSUM_H"], alpha=configVars["DRIFT_EWMA_ALPHA"],
+                                            minSigma=configVars["DRIFT_MIN_SIGMA"])
+
+    def update(self, traceResults: dict, ardResultsRes: list):
+        """
+        Adds a reading
+        Args:
+            traceResults: The dict from `calculate.get_trace_analysis`
+            ardResultsRes: The inner and outer FSR resistances. Empty if the read failed
+
+        Returns: (`dict`) The step change from `DriftDetector.add`, if one was detected
+        """
+        self.stats["resonance_freq"].add(traceResults["resonance_freq"])
+        self.stats["bandwidth"].add(traceResults["bandwidth"])
+        self.stats["q_factor"].add(traceResults["q_factor"])
+        if len(ardResultsRes) >= 2:
+            self.stats["fsr_res_inner"].add(ardResultsRes[0])
+            self.stats["fsr_res_outer"].add(ardResultsRes[1])
+        return self.drift_detector.add(traceResults["resonance_freq"])
+
+    def get_summary(self):
+        summary = {quantity: stats.get_summary() for quantity, stats in self.stats.items()}
+        summary["resonance_freq_ewma"] = self.drift_detector.ewma
+        summary["resonance_steps"] = self.drift_detector.step_count
+        return summary
+
+    def get_summary_text(self):
+        def describe(quantity: str, label: str, unit: str, precision: int):
+            stats = self.stats[quantity]
+            if stats.count == 0:
+                return f"{label} -"
+            return f"{label} {stats.mean:.{precision}f}±{stats.get_std():.{precision}f}{unit} [{stats.minimum:.{precision}f}, {stats.maximum:.{precision}f}]"
+
+        return " | ".join([describe("resonance_freq", "f0", " MHz", 3),
+                           describe("bandwidth", "BW", " MHz", 3),
+                           describe("q_factor", "Q", "", 2),
+                           describe("fsr_res_inner", "R_in", " ohm", 0),
+                           describe("fsr_res_outer", "R_out", " ohm", 0),
+                           f"steps {self.drift_detector.step_count}"])
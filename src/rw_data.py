@@ -10,6 +10,11 @@ import os
 import pathlib
 import csv
 import contextlib
+import itertools
+import time
+import numpy
+
+import src.instrumentation as INSTR
 
 @contextlib.contextmanager
 def open_f(file, newline, mode):
@@ -46,15 +51,195 @@ def initialise_results_file(config_vars: dict, field_names: list, timestamp: str
             writer.writeheader()
     return True
 
-def write_operation(config_vars: dict, data: list, field_names: list, timestamp: str):
+def format_array_cell(values: numpy.ndarray):
+    """
+    Formats a NumPy array as a list literal for a CSV cell, e.g. "[-8.89, -8.86]". Unlike `str()` on an array, no values are elided with "..." and the result can be read back with `ast.literal_eval`.
+    Args:
+        values: A one-dimensional NumPy array
+
+    Returns: (`str`) The formatted cell
+    """
+    return "[" + ", ".join(values.astype(str)) + "]"
+
+
+def format_row(row: dict):
+    """
+    Formats any NumPy array values in a results row so the row can be passed to `csv.DictWriter`
+    Args:
+        row: A results row addressable by field name
+
+    Returns: (`dict`) The row with array values formatted as list literals
+    """
+    return {key: format_array_cell(value) if isinstance(value, numpy.ndarray) else value for key, value in row.items()}
+
+
+def get_results_file_path(config_vars: dict, timestamp: str):
     folder_name = config_vars["OUTPUT_FOLDER"]
     file_name = config_vars["OUTPUT_FILE_NAME"]
     dir_location = pathlib.Path.cwd().joinpath(f"{folder_name}/")
-    file_path = None
     if timestamp != "":
-        file_path = dir_location.joinpath(file_name + "-" + timestamp + ".csv")
-    else:
-        file_path = dir_location.joinpath(file_name + ".csv")
+        return dir_location.joinpath(file_name + "-" + timestamp + ".csv")
+    return dir_location.joinpath(file_name + ".csv")
+
+
+# Fixed size of the NPY header so that it can be rewritten in place as rows are appended
+NPY_HEADER_SIZE = 128
+
+
+def get_trace_store_path(results_file_path: pathlib.Path):
+    """
+    Returns the path of the binary trace store kept beside a results file, e.g. "logfile-1.traces.npy" for "logfile-1.csv"
+    """
+    return results_file_path.with_suffix(".traces.npy")
+
+
+class TraceStoreWriter:
+    """
+    Appends traces as rows of a float32 matrix in an NPY file that `read_traces` can memory-map.
+    The header's row count is rewritten on every `flush`, so the file stays readable up to the last flush if the run ends unexpectedly.
+    """
+
+    def __init__(self, file_path: pathlib.Path, points: int):
+        self.file_path = file_path
+        self.points = int(points)
+        self.row_count = 0
+        self._file = open(file=file_path, mode="wb")
+        self._write_header()
+
+    def _write_header(self):
+        header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (self.row_count, self.points)
+        preamble = numpy.lib.format.magic(1, 0) + (NPY_HEADER_SIZE - 10).to_bytes(2, "little")
+        self._file.write(preamble + header.ljust(NPY_HEADER_SIZE - 10 - 1).encode("latin1") + b"\n")
+
+    def write_trace(self, trace: numpy.ndarray):
+        """
+        Appends a trace
+        Returns: (`int`) The trace's row in the store
+        """
+        trace = numpy.asarray(trace, dtype="<f4")
+        if trace.shape != (self.points,):
+            raise ValueError(f"Trace has {trace.size} points but the trace store holds {self.points} points per row")
+        self._file.write(trace.tobytes())
+        self.row_count += 1
+        return self.row_count - 1
+
+    def flush(self):
+        self._file.seek(0)
+        self._write_header()
+        self._file.seek(0, os.SEEK_END)
+        self._file.flush()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+
+def read_traces(file_path: pathlib.Path, rows=None):
+    """
+    Reads traces from a trace store without loading the whole file
+    Args:
+        file_path: The path of the ".traces.npy" trace store
+        rows: A row index, slice or list of rows. All rows if not given
+
+    Returns: (`numpy.ndarray`) A read-only memory-mapped (rows x points) float32 array, or a single trace if `rows` is an int
+    """
+    traces = numpy.load(file_path, mmap_mode="r")
+    if rows is None:
+        return traces
+    return traces[rows]
+
+
+class ResultsStreamWriter:
+    """
+    Keeps a results file open for a whole run and appends rows as they are taken.
+    Rows are written in batches of `flush_rows`. A partial batch is also written, and the file synced to disk, once `fsync_interval` seconds have passed since the last sync. Memory use therefore does not grow with the number of rows.
+    With a `trace_field`, that field's traces go to a binary trace store beside the results file and its cells are left empty.
+    """
+
+    def __init__(self, file_path: pathlib.Path, field_names: list, flush_rows: int, fsync_interval: float, trace_field: str = None):
+        self.file_path = file_path
+        self.field_names = field_names
+        self.flush_rows = max(1, int(flush_rows))
+        self.fsync_interval = fsync_interval
+        self.trace_field = trace_field
+        self.trace_store = None
+        self.row_count = 0
+        self._pending_rows = list()
+        self._file = open(file=file_path, newline="", mode="a")
+        self._writer = csv.DictWriter(self._file, field_names)
+        self._last_fsync = time.monotonic()
+
+    @INSTR.timed("rw.write_row")
+    def write_row(self, row: dict):
+        """
+        Queues a row for writing. Array values are formatted straight away, so the caller may reuse `row`
+        """
+        if self.trace_field is not None:
+            if self.trace_store is None:
+                self.trace_store = TraceStoreWriter(file_path=get_trace_store_path(self.file_path), points=len(row[self.trace_field]))
+            self.trace_store.write_trace(row[self.trace_field])
+            row = dict(row)
+            row[self.trace_field] = None
+        self._pending_rows.append(format_row(row))
+        self.row_count += 1
+        if len(self._pending_rows) >= self.flush_rows or time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self.flush()
+
+    @INSTR.timed("rw.flush")
+    def flush(self):
+        if self._pending_rows:
+            self._writer.writerows(self._pending_rows)
+            self._pending_rows.clear()
+        self._file.flush()
+        if self.trace_store is not None:
+            self.trace_store.flush()
+        if time.monotonic() - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            if self.trace_store is not None:
+                os.fsync(self.trace_store.fileno())
+            self._last_fsync = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._last_fsync = float("-inf")
+        self.flush()
+        self._file.close()
+        if self.trace_store is not None:
+            self.trace_store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_results_stream(config_vars: dict, field_names: list, timestamp: str):
+    """
+    Opens a `ResultsStreamWriter` on a results file created by `initialise_results_file`.
+    With `OUTPUT_FORMAT` set to "npy" the traces (the sixth field) are kept in a binary trace store instead of the CSV
+    Returns: (`ResultsStreamWriter`) The writer, or `None` if the file cannot be opened
+    """
+    file_path = get_results_file_path(config_vars=config_vars, timestamp=timestamp)
+    trace_field = field_names[5] if config_vars["OUTPUT_FORMAT"] == "npy" else None
+    try:
+        return ResultsStreamWriter(file_path=file_path, field_names=field_names,
+                                   flush_rows=config_vars["OUTPUT_FLUSH_ROWS"],
+                                   fsync_interval=config_vars["OUTPUT_FSYNC_INTERVAL"],
+                                   trace_field=trace_field)
+    except IOError as err:
+        print("IOError when opening the results file!", err)
+        return None
+
+
+def write_operation(config_vars: dict, data: list, field_names: list, timestamp: str):
+    file_path = get_results_file_path(config_vars=config_vars, timestamp=timestamp)
 
     with open_f(file=file_path, newline="", mode="a+") as (csvfile, err):
         if err:
@@ -62,7 +247,7 @@ def write_operation(config_vars: dict, data: list, field_names: list, timestamp:
             return False
         else:
             writer = csv.DictWriter(csvfile, field_names)
-            writer.writerows(data)
+            writer.writerows(format_row(row) for row in data)
     return True
 
 
@@ -84,6 +269,80 @@ def read_operation(file_path: pathlib.PosixPath, field_names: list):
         return status, return_data
 
 
+# How each of the FIELD_NAMES columns is parsed by iter_results, by position
+FIELD_TYPES = ["float", "int", "float", "float", "str", "array", "array", "array", "float", "float", "float", "float", "float"]
+
+
+def parse_array_cell(cell: str):
+    """
+    Parses a list-literal cell such as "[-8.89, -8.86]" into a float64 NumPy array in a single vectorised pass
+    Args:
+        cell: The cell text. Space-separated values from `str()` of an array are also accepted
+
+    Returns: (`numpy.ndarray`) The values, or `None` for an empty cell
+    """
+    cell = cell.strip()
+    if cell == "":
+        return None
+    separator = "," if "," in cell else " "
+    return numpy.fromstring(cell.strip("[]"), dtype=numpy.float64, sep=separator)
+
+
+def parse_cell(cell: str, field_type: str):
+    if field_type == "str":
+        return cell
+    if field_type == "array":
+        return parse_array_cell(cell)
+    cell = cell.strip()
+    if cell == "" or cell == "None":
+        return None
+    if field_type == "int":
+        return int(float(cell))
+    return float(cell)
+
+
+def iter_raw_rows(file_path: pathlib.Path):
+    """
+    Yields the unparsed bytes of each data row of a results file, skipping the header row
+    """
+    with open(file_path, mode="rb") as results_file:
+        results_file.readline()
+        for line in results_file:
+            yield line.rstrip(b"\r\n")
+
+
+def iter_results(file_path: pathlib.Path, field_names: list, row_filter=None):
+    """
+    Reads a results file one row at a time, so memory use does not depend on the length of the run.
+    The file's header row is used for the field names and is not returned as data. Values are converted according to `FIELD_TYPES`, with array cells as NumPy arrays and empty cells as `None`.
+    Args:
+        file_path: The results file
+        field_names: The expected field names. Used if the file has no header row
+        row_filter: Optional callable taking a row index. Rows it returns False for are yielded as `None` without being parsed
+
+    Returns:
+        A generator of dicts addressable by field name
+    """
+    with open(file=file_path, newline="", mode="r") as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+        if header is None:
+            return
+        try:
+            float(header[0])
+            # No header row in the file, so the first row is data
+            reader = itertools.chain([header], reader)
+            header = field_names
+        except (ValueError, IndexError):
+            pass
+        for row_idx, row in enumerate(reader):
+            if row_filter is not None and not row_filter(row_idx):
+                yield None
+                continue
+            yield {name: parse_cell(cell, FIELD_TYPES[idx]) if idx < len(FIELD_TYPES) else cell
+                   for idx, (name, cell) in enumerate(zip(header, row))}
+
+
 def list_files(folder_name: str, file_format: str):
     dir_location = pathlib.Path.cwd().joinpath(f"{folder_name}/")
     file_path_list = dir_location.glob(f"*.{file_format}")
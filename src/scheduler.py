@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fixed-rate scheduling of the data acquisition cycles
+Cycles start on a grid of absolute deadlines on the monotonic clock, so the time spent on each cycle's I/O and analysis does not add up into drift
+"""
+import collections
+import math
+import time
+
+# The most cycles kept in each of the recent and overrun cycle logs, so that memory stays bounded however long the run is
+CYCLE_LOG_LENGTH = 1000
+
+
+class FixedRateScheduler:
+    """
+    Waits for cycle k to start at `startTime + k * period`.
+    A cycle whose work runs past the next deadline is an overrun. The deadlines it missed are skipped rather than caught up on, so every cycle still starts on the grid.
+    The lateness of each start against its deadline is recorded as jitter, and kept for the latest `CYCLE_LOG_LENGTH` cycles and the latest `CYCLE_LOG_LENGTH` overruns so the cadence of a run can be checked afterwards
+    """
+
+    def __init__(self, period: float, startTime: float = None):
+        self.period = float(period)
+        self.start_time = time.monotonic() if startTime is None else float(startTime)
+        self.cycle_index = 0
+        self.overrun_count = 0
+        self.skipped_cycles = 0
+        self.jitter_count = 0
+        self.jitter_sum = 0.0
+        self.jitter_sum_sq = 0.0
+        self.jitter_max = 0.0
+        self.recent_cycles = collections.deque(maxlen=CYCLE_LOG_LENGTH)
+        self.overrun_cycles = collections.deque(maxlen=CYCLE_LOG_LENGTH)
+
+    def get_deadline(self, cycleIndex: int):
+        return self.start_time + cycleIndex * self.period
+
+    def wait_next(self):
+        """
+        Sleeps until the deadline of the next cycle
+        Returns: (`bool`) `False` if the previous cycle overran its period
+        """
+        self.cycle_index += 1
+        if self.period <= 0:
+            return True
+
+        deadline = self.get_deadline(self.cycle_index)
+        now = time.monotonic()
+        is_on_time = now <= deadline
+        skipped_cycles = 0
+        if not is_on_time:
+            self.overrun_count += 1
+            next_index = math.ceil((now - self.start_time) / self.period)
+            skipped_cycles = next_index - self.cycle_index
+            self.skipped_cycles += skipped_cycles
+            self.cycle_index = next_index
+            deadline = self.get_deadline(self.cycle_index)
+
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        self._record_jitter(time.monotonic() - deadline, isOverrun=not is_on_time, skippedCycles=skipped_cycles)
+        return is_on_time
+
+    def _record_jitter(self, lateness: float, isOverrun: bool, skippedCycles: int):
+        cycle = {"cycle": self.cycle_index, "lateness_s": lateness, "overrun": isOverrun, "skipped_cycles": skippedCycles}
+        self.recent_cycles.append(cycle)
+        if isOverrun:
+            self.overrun_cycles.append(cycle)
+        self.jitter_count += 1
+        self.jitter_sum += lateness
+        self.jitter_sum_sq += lateness * lateness
+        self.jitter_max = max(self.jitter_max, lateness)
+
+    def get_summary(self):
+        """
+        Returns: (`dict`) The `period`, `cycles` scheduled, `overruns`, `skipped_cycles` and the mean, RMS and maximum start jitter in seconds
+        """
+        jitter_mean, jitter_rms = 0.0, 0.0
+        if self.jitter_count > 0:
+            jitter_mean = self.jitter_sum / self.jitter_count
+            jitter_rms = math.sqrt(self.jitter_sum_sq / self.jitter_count)
+        return {
+            "period": self.period,
+            "cycles": self.cycle_index,
+            "overruns": self.overrun_count,
+            "skipped_cycles": self.skipped_cycles,
+            "jitter_mean": jitter_mean,
+            "jitter_rms": jitter_rms,
+            "jitter_max": self.jitter_max
+        }
+
+    def get_cycle_log(self):
+        """
+        Returns: (`dict`) The `recent` cycles started by `wait_next` and the `overruns` among all of them, each the latest `CYCLE_LOG_LENGTH` at most. Each cycle is a dict with its grid index `cycle`, the `lateness_s` of its start, whether the cycle before it was an `overrun` and the `skipped_cycles` that overrun cost
+        """
+        return {"recent": list(self.recent_cycles), "overruns": list(self.overrun_cycles)}
+
+    def get_summary_text(self):
+        summary = self.get_summary()
+        return (f"period {summary['period']} s, {summary['overruns']} overruns ({summary['skipped_cycles']} cycles skipped), "
+                f"start jitter mean {summary['jitter_mean'] * 1000:.2f} ms, RMS {summary['jitter_rms'] * 1000:.2f} ms, max {summary['jitter_max'] * 1000:.2f} ms")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Host-side emulator of the FSR firmware in arduino_code/arduino_code.ino
+Opens a pseudo-terminal pair and answers the handshake and INST:READ commands on it, so conn_arduino.py can be exercised without an Arduino
+Selected with an `ARDUINO_PORT` starting with `conn_arduino.SIM_PORT_PREFIX` (e.g. "SIM::UNO"), or run on its own with `python -m src.sim_arduino` to serve another process
+"""
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+# Mirrors the constants in arduino_code.ino
+SUPPLY_VOLTAGE = 5.0
+R_FIXED1_TOP = 47000.0
+R_FIXED2_BTM = 1000.0
+ADC_RESOLUTION_BIT = 10.0
+
+# Typical unloaded ADC readings of the inner and outer sense dividers
+ADC_BASELINE = (612, 587)
+
+
+def convert_ADC_to_V(adc_reading: int):
+    return (adc_reading / pow(2, ADC_RESOLUTION_BIT)) * SUPPLY_VOLTAGE
+
+
+def calc_r_sense(v_sense: float):
+    return (R_FIXED2_BTM - (v_sense / SUPPLY_VOLTAGE) * (R_FIXED2_BTM + R_FIXED1_TOP)) / (v_sense / SUPPLY_VOLTAGE - 1)
+
+
+def format_float(value: float):
+    # Arduino's String(float) prints two decimal places
+    return f"{value:.2f}"
+
+
+class ArduinoEmulator:
+    """
+    Answers the firmware's line-based protocol on the master side of a pty. Open the emulated port with `port_name`.
+    Each response is sent `latency` seconds after its command arrives and paced at `baudRate` (10 bits per byte for 8N1). ADC readings get Gaussian noise with a standard deviation of `noise` counts.
+    """
+
+    def __init__(self, latency: float = 0.002, baudRate: int = 9600, noise: float = 2.0, seed: int = 0):
+        self.latency = float(latency)
+        self.baud_rate = int(baudRate)
+        self.noise = float(noise)
+        self.port_name = None
+        self.request_count = 0
+        self._rng = random.Random(seed)
+        self._master_fd = None
+        self._slave_fd = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """
+        Opens the pty pair and starts answering commands in a background thread
+        Returns: (`str`) The device path of the emulated serial port
+        """
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self.port_name = os.ttyname(self._slave_fd)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._serve, name="ArduinoEmulator", daemon=True)
+        self._thread.start()
+        return self.port_name
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        for fd in (self._master_fd, self._slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self._master_fd, self._slave_fd, self._thread = None, None, None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _serve(self):
+        buffer = bytearray()
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self._master_fd], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                buffer += os.read(self._master_fd, 1024)
+            except OSError:
+                break
+            while b"\n" in buffer:
+                line, _, buffer = buffer.partition(b"\n")
+                command = line.decode(encoding="ascii", errors="replace").strip()
+                if command == "":
+                    continue
+                self.request_count += 1
+                self._respond(self.execute_cmd(command))
+
+    def _respond(self, response: str):
+        data = (response + "\r\n").encode(encoding="ascii")
+        time.sleep(self.latency + len(data) * 10 / self.baud_rate)
+        try:
+            os.write(self._master_fd, data)
+        except OSError:
+            pass
+
+    def acquire_data(self):
+        readings = dict()
+        for name, baseline in zip(("inner", "outer"), ADC_BASELINE):
+            adc_reading = int(round(baseline + self._rng.gauss(0.0, self.noise)))
+            adc_reading = min(max(adc_reading, 1), int(pow(2, ADC_RESOLUTION_BIT)) - 1)
+            voltage = convert_ADC_to_V(adc_reading)
+            readings[f"{name}_voltage"] = voltage
+            readings[f"{name}_resistance"] = calc_r_sense(voltage)
+        return readings
+
+    def execute_cmd(self, command: str):
+        match command:
+            case "INIT:RXTX:CHK":
+                return "INIT:RXTX:SUC"
+            case "INST:READ:ALL":
+                data = self.acquire_data()
+                values = [data["inner_resistance"], data["outer_resistance"], data["inner_voltage"], data["outer_voltage"]]
+            case "INST:READ:RES":
+                data = self.acquire_data()
+                values = [data["inner_resistance"], data["outer_resistance"]]
+            case "INST:READ:VOL":
+                data = self.acquire_data()
+                values = [data["inner_voltage"], data["outer_voltage"]]
+            case _:
+                return "ERROR Command not recognised: Command Invalid"
+        return ",".join(format_float(value) for value in values)
+
+
+def open_emulator(configVars: dict):
+    """
+    Starts an emulator using the "SIM_ARD_" settings and the configured baud rate
+    Returns: (`ArduinoEmulator`) The running emulator. Its `port_name` is the port to connect to
+    """
+    emulator = ArduinoEmulator(latency=configVars["SIM_ARD_LATENCY"], baudRate=configVars["ARDUINO_BAUD"],
+                               noise=configVars["SIM_ARD_NOISE"], seed=configVars["SIM_SEED"])
+    emulator.start()
+    return emulator
+
+
+if __name__ == '__main__':
+    import src.aux_fns as AUXFN
+
+    emulator = open_emulator(configVars=AUXFN.get_default_configuration())
+    print(f"NOTICE Arduino emulator serving on {emulator.port_name}. Press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        print(f"NOTICE Arduino emulator stopped after {emulator.request_count} requests")
+        emulator.stop()
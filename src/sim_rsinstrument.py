@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process stand-in for the R&S ZVH8 that is selected with a `VNA_RESOURCE` starting with "SIM::" (e.g. "SIM::ZVH8")
+Implements the SCPI subset used by conn_rsinstrument.py and generates synthetic resonant S11 traces so the acquisition path can be exercised and profiled without the instrument
+"""
+import re
+import threading
+import time
+
+import numpy
+import RsInstrument
+
+SIM_RESOURCE_PREFIX = "SIM::"
+SIM_IDN = "Rohde&Schwarz,ZVH8-SIM,1309.6800K28/100000,SIM"
+
+# Resonator model used for the synthetic S11 traces
+RESONANCE_FREQ = 950e6
+RESONANCE_DRIFT = 2e6
+RESONANCE_DRIFT_SWEEPS = 200
+UNLOADED_Q = 80.0
+COUPLING = 1.065
+NOISE_DB = 0.05
+REFERENCE_IMPEDANCE = 50.0
+
+# Settings that are stored and read back as given without further simulation
+PLAIN_SETTINGS = {
+    "MEAS:PORT": "1",
+    "MEAS:FUNC:SEL": "S11",
+    "DISP:MAGN:Y:SPAC": "LOG",
+    "DISP:MAGN:REF": "0",
+    "DISP:MAGN:Y:SCAL": "60",
+}
+
+CAL_STEPS = ["Connect OPEN to port 1", "Connect SHORT to port 1", "Connect LOAD to port 1", "Calibration done"]
+
+
+def is_sim_resource(resource_name: str):
+    return str(resource_name).upper().startswith(SIM_RESOURCE_PREFIX)
+
+
+def get_short_form(mnemonic: str):
+    """
+    Converts a SCPI mnemonic in any form ("FREQuency", "FREQUENCY", "freq") to its short form ("FREQ")
+    Args:
+        mnemonic: The mnemonic without its numeric suffix
+
+    Returns: (`str`) The upper case short form
+    """
+    mnemonic = mnemonic.upper()
+    if len(mnemonic) <= 4 or mnemonic.startswith("*"):
+        return mnemonic
+    if mnemonic[3] in "AEIOU":
+        return mnemonic[:3]
+    return mnemonic[:4]
+
+
+def parse_frequency(text: str):
+    """
+    Parses a SCPI frequency parameter such as "750MHz", "1.15 GHz" or "450000000" into Hz
+    """
+    match = re.fullmatch(r"\s*([-+0-9.eE]+)\s*([kKmMgG]?)(?:[hH][zZ])?\s*", text)
+    if match is None:
+        raise ValueError(text)
+    multiplier = {"": 1.0, "K": 1e3, "M": 1e6, "G": 1e9}[match.group(2).upper()]
+    return float(match.group(1)) * multiplier
+
+
+def split_message(message: str):
+    """
+    Splits a SCPI program message on ";" into its commands, ignoring separators inside quoted strings
+    """
+    commands, buffer, quote = list(), str(), None
+    for char in message:
+        if quote is not None:
+            quote = None if char == quote else quote
+        elif char in "'\"":
+            quote = char
+        elif char == ";":
+            commands.append(buffer.strip())
+            buffer = str()
+            continue
+        buffer += char
+    if buffer.strip():
+        commands.append(buffer.strip())
+    return commands
+
+
+class SimulatedInstrument:
+    """
+    Drop-in replacement for the parts of `RsInstrument.RsInstrument` that this project uses.
+    Sweeps take `sweepTime` seconds. Every message costs `transferLatency` seconds plus the size of its response over `transferRate` bytes per second.
+    In continuous mode a new sweep completes every `sweepTime` seconds. With continuous mode off, "INIT:IMM" starts a single sweep and any "*OPC?" synchronisation waits for it to complete.
+    """
+
+    def __init__(self, resource_name: str, id_query: bool = True, reset: bool = False, sweepTime: float = 0.25,
+                 transferLatency: float = 0.002, transferRate: float = 5e6, seed: int = 0):
+        self.resource_name = resource_name
+        self.visa_timeout = 5000
+        self.opc_timeout = 5000
+        self.instrument_status_checking = True
+        self.sweep_time = float(sweepTime)
+        self.transfer_latency = float(transferLatency)
+        self.transfer_rate = float(transferRate)
+        self.seed = int(seed)
+        self.idn_string = SIM_IDN
+        self._lock = threading.RLock()
+        self._is_open = True
+        self._stored_states = dict()
+        self._error_queue = list()
+        self._reset_state()
+        if reset:
+            self.reset()
+        if id_query:
+            self.query_str("*IDN?")
+
+    # ---- RsInstrument API ----
+    def write_str(self, cmd: str):
+        self._transact(cmd)
+
+    def write(self, cmd: str):
+        self._transact(cmd)
+
+    def write_str_with_opc(self, cmd: str, timeout: int = None):
+        self._transact(cmd, timeout=timeout, withOpc=True)
+
+    def write_with_opc(self, cmd: str, timeout: int = None):
+        self._transact(cmd, timeout=timeout, withOpc=True)
+
+    def query_str(self, query: str):
+        return self._transact(query)
+
+    def query(self, query: str):
+        return self._transact(query)
+
+    def query_str_with_opc(self, query: str, timeout: int = None):
+        return self._transact(query, timeout=timeout, withOpc=True)
+
+    def query_with_opc(self, query: str, timeout: int = None):
+        return self._transact(query, timeout=timeout, withOpc=True)
+
+    def query_opc(self, timeout: int = 0):
+        self._wait_for_sweep(timeout=timeout)
+        return 1
+
+    def query_bin_block(self, query: str):
+        return self._transact(query, binary=True)
+
+    def query_bin_block_with_opc(self, query: str, timeout: int = None):
+        return self._transact(query, timeout=timeout, withOpc=True, binary=True)
+
+    def query_bin_or_ascii_float_list(self, query: str):
+        return self._to_float_list(self._transact(query, binary=True))
+
+    def query_bin_or_ascii_float_list_with_opc(self, query: str, timeout: int = None):
+        return self._to_float_list(self._transact(query, timeout=timeout, withOpc=True, binary=True))
+
+    def query_all_errors(self):
+        with self._lock:
+            errors = [f'{code},"{text}"' for code, text in self._error_queue]
+            self._error_queue.clear()
+        return errors if errors else None
+
+    def clear_status(self):
+        self._transact("*CLS")
+
+    def reset(self):
+        self._transact("*RST", withOpc=True)
+
+    def is_connection_active(self):
+        return self._is_open
+
+    def close(self):
+        self._is_open = False
+
+    # ---- Message handling ----
+    def _transact(self, message: str, timeout: int = None, withOpc: bool = False, binary: bool = False):
+        if not self._is_open:
+            raise RsInstrument.RsInstrException(f"Session to {self.resource_name} is closed")
+        with self._lock:
+            if withOpc:
+                self._wait_for_sweep(timeout=timeout)
+            responses = list()
+            parent = tuple()
+            for command in split_message(message):
+                response, parent = self._execute(command, parent)
+                if response is not None:
+                    responses.append(response)
+            if withOpc:
+                self._wait_for_sweep(timeout=timeout)
+
+            response = None
+            response_size = 0
+            if responses:
+                if binary and len(responses) == 1 and isinstance(responses[0], bytes):
+                    response = responses[0]
+                    response_size = len(response) + 2 + len(str(len(response)))
+                else:
+                    response = ";".join(x.decode("latin-1") if isinstance(x, bytes) else x for x in responses)
+                    response_size = len(response) + 1
+            time.sleep(self.transfer_latency + response_size / self.transfer_rate)
+
+            if self.instrument_status_checking and self._error_queue:
+                errors = list(self._error_queue)
+                self._error_queue.clear()
+                error_text = ", ".join(f'{code},"{text}"' for code, text in errors)
+                raise RsInstrument.StatusException(self.resource_name, f"'{message}' - Instrument error detected: {error_text}", errors)
+        return response
+
+    def _wait_for_sweep(self, timeout: int = None):
+        if self._sweep_done_at is None:
+            return
+        timeout_ms = self.opc_timeout if not timeout else timeout
+        remaining = self._sweep_done_at - time.monotonic()
+        if remaining * 1000 > timeout_ms:
+            time.sleep(timeout_ms / 1000)
+            raise RsInstrument.TimeoutException(f"Timeout expired waiting for the sweep on {self.resource_name} to complete")
+        if remaining > 0:
+            time.sleep(remaining)
+        self._sweep_count += 1
+        self._sweep_done_at = None
+
+    def _execute(self, command: str, parent: tuple):
+        """
+        Executes a single command. Returns its response (`None` for settings) and the header path that following relative commands use
+        """
+        header, _, params = command.partition(" ")
+        params = params.strip()
+        is_query = header.endswith("?")
+        header = header.rstrip("?")
+
+        if header.startswith("*"):
+            # Common commands leave the current header path unchanged
+            path, nodes = parent, [(header.upper(), "")]
+        else:
+            path = tuple() if header.startswith(":") else parent
+            nodes = list()
+            for node in header.strip(":").split(":"):
+                match = re.fullmatch(r"([A-Za-z]+)(\d*)", node)
+                if match is None:
+                    self._push_error(-113, "Undefined header")
+                    return None, parent
+                nodes.append((get_short_form(match.group(1)), match.group(2)))
+            nodes = list(path) + nodes
+            path = tuple(nodes[:-1])
+
+        # Optional nodes
+        keys = [name for name, _ in nodes]
+        if keys and keys[0] == "SENS":
+            keys = keys[1:]
+        if keys and keys[-1] in ("DATA", "NEXT") and keys[0] in ("FORM", "SYST"):
+            keys = keys[:-1]
+        if keys == ["INIT"]:
+            keys = ["INIT", "IMM"]
+        key = ":".join(keys) + ("?" if is_query else "")
+
+        try:
+            return self._dispatch(key, params), path
+        except (ValueError, IndexError):
+            self._push_error(-224, "Illegal parameter value")
+            return None, path
+
+    def _dispatch(self, key: str, params: str):
+        state = self._state
+        match key:
+            case "*IDN?":
+                return self.idn_string
+            case "*OPC?":
+                self._wait_for_sweep()
+                return "1"
+            case "*OPC" | "*WAI":
+                self._wait_for_sweep()
+            case "*CLS":
+                self._error_queue.clear()
+            case "*RST":
+                self._reset_state()
+            case "SYST:ERR?":
+                if self._error_queue:
+                    code, text = self._error_queue.pop(0)
+                    return f'{code},"{text}"'
+                return '0,"No error"'
+            case "SYST:ERR:ALL?":
+                errors = ",".join(f'{code},"{text}"' for code, text in self._error_queue)
+                self._error_queue.clear()
+                return errors if errors else '0,"No error"'
+            case "FREQ:STAR":
+                state["start_freq"] = parse_frequency(params)
+            case "FREQ:STOP":
+                state["stop_freq"] = parse_frequency(params)
+            case "FREQ:STAR?":
+                return f"{state['start_freq']:.0f}"
+            case "FREQ:STOP?":
+                return f"{state['stop_freq']:.0f}"
+            case "SWE:POIN":
+                points = int(float(params))
+                if not 2 <= points <= 4001:
+                    raise ValueError(params)
+                state["points"] = points
+            case "SWE:POIN?":
+                return str(state["points"])
+            case "SWE:TIME?":
+                return f"{self.sweep_time:.6g}"
+            case "INIT:CONT":
+                self._sweep_count = self._get_sweep_index()
+                state["continuous"] = params.upper() in ("ON", "1")
+                if state["continuous"]:
+                    self._sweep_done_at = None
+                    self._continuous_since = time.monotonic()
+                    self._sweep_count_at_continuous = self._sweep_count
+            case "INIT:CONT?":
+                return "1" if state["continuous"] else "0"
+            case "INIT:IMM":
+                if not state["continuous"]:
+                    self._sweep_done_at = time.monotonic() + self.sweep_time
+            case "FORM":
+                form = params.replace(" ", "").upper()
+                if form in ("ASC", "ASCII"):
+                    state["format"] = "ASC"
+                elif form in ("REAL,32", "REAL"):
+                    state["format"] = "REAL,32"
+                else:
+                    raise ValueError(params)
+            case "FORM?":
+                return state["format"]
+            case "FORM:BORD":
+                byte_order = get_short_form(params.strip())
+                if byte_order not in ("SWAP", "NORM"):
+                    raise ValueError(params)
+                state["byte_order"] = byte_order
+            case "FORM:BORD?":
+                return state["byte_order"]
+            case "TRAC:DATA?":
+                trace, _ = self._get_trace()
+                if state["format"] == "REAL,32":
+                    return trace.astype(self._get_binary_dtype()).tobytes()
+                return ",".join(f"{value:.9g}" for value in trace)
+            case "CALC:MARK":
+                state["marker_on"] = params.upper() in ("ON", "1")
+            case "CALC:MARK?":
+                return "1" if state["marker_on"] else "0"
+            case "CALC:MARK:X:SLIM":
+                state["slim_on"] = params.upper() in ("ON", "1")
+            case "CALC:MARK:X:SLIM:RIGH":
+                state["slim_right"] = parse_frequency(params)
+            case "CALC:MARK:X:SLIM:LEFT":
+                state["slim_left"] = parse_frequency(params)
+            case "CALC:MARK:MIN:PEAK" | "CALC:MARK:MIN":
+                if not state["marker_on"]:
+                    raise ValueError(key)
+                trace, freq = self._get_trace()
+                if state["slim_on"]:
+                    in_limits = (freq >= state["slim_left"]) & (freq <= state["slim_right"])
+                    if in_limits.any():
+                        trace = numpy.where(in_limits, trace, numpy.inf)
+                state["marker_x"] = float(freq[int(numpy.argmin(trace))])
+            case "CALC:MARK:MODE":
+                mode = params.upper()
+                if mode.startswith("IMP"):
+                    state["marker_mode"] = "IMP"
+                elif mode == "RPDB":
+                    state["marker_mode"] = "RPDB"
+                else:
+                    raise ValueError(params)
+            case "CALC:MARK:MODE?":
+                return state["marker_mode"]
+            case "CALC:MARK:X":
+                state["marker_x"] = parse_frequency(params)
+            case "CALC:MARK:X?":
+                return f"{state['marker_x']:.0f}"
+            case "CALC:MARK:Y?":
+                if not state["marker_on"]:
+                    raise ValueError(key)
+                gamma = self._get_reflection(numpy.asarray([state["marker_x"]]), self._get_sweep_index())[0]
+                if state["marker_mode"] == "IMP":
+                    impedance = REFERENCE_IMPEDANCE * (1 + gamma) / (1 - gamma)
+                    return f"{impedance.real:.6g},{impedance.imag:.6g}"
+                return f"{20 * numpy.log10(abs(gamma)):.6g},{numpy.degrees(numpy.angle(gamma)):.6g}"
+            case "MMEM:STOR:STAT":
+                self._stored_states[self._parse_state_name(params)] = dict(state)
+            case "MMEM:LOAD:STAT":
+                name = self._parse_state_name(params)
+                if name not in self._stored_states:
+                    self._push_error(-256, "File name not found")
+                else:
+                    self._state = dict(self._stored_states[name])
+            case "CAL:MODE?":
+                return "1" if state["calibrated"] else "0"
+            case "CAL:STAR?":
+                self._cal_step = 0
+                return CAL_STEPS[self._cal_step]
+            case "CAL:CONT?":
+                self._cal_step = min(self._cal_step + 1, len(CAL_STEPS) - 1)
+                if CAL_STEPS[self._cal_step] == "Calibration done":
+                    state["calibrated"] = True
+                return CAL_STEPS[self._cal_step]
+            case "CAL:ABOR":
+                self._cal_step = 0
+            case _:
+                setting = key.rstrip("?")
+                if setting not in PLAIN_SETTINGS:
+                    self._push_error(-113, "Undefined header")
+                elif key.endswith("?"):
+                    return state["settings"][setting]
+                else:
+                    state["settings"][setting] = params
+        return None
+
+    # ---- Simulation ----
+    def _reset_state(self):
+        self._state = {
+            "start_freq": 450e6,
+            "stop_freq": 1250e6,
+            "points": 401,
+            "continuous": True,
+            "format": "ASC",
+            # Big-endian until set, so that a client assuming the byte order is caught out
+            "byte_order": "NORM",
+            "marker_on": False,
+            "marker_mode": "RPDB",
+            "marker_x": 850e6,
+            "slim_on": False,
+            "slim_left": 450e6,
+            "slim_right": 1250e6,
+            "calibrated": False,
+            "settings": dict(PLAIN_SETTINGS),
+        }
+        self._error_queue.clear()
+        self._cal_step = 0
+        self._sweep_count = 0
+        self._sweep_done_at = None
+        self._continuous_since = time.monotonic()
+        self._sweep_count_at_continuous = 0
+
+    def _push_error(self, code: int, text: str):
+        self._error_queue.append((code, text))
+
+    @staticmethod
+    def _parse_state_name(params: str):
+        return params.split(",")[-1].strip().strip("'\"")
+
+    def _get_sweep_index(self):
+        if self._sweep_done_at is not None and time.monotonic() >= self._sweep_done_at:
+            self._sweep_count += 1
+            self._sweep_done_at = None
+        if self._state["continuous"]:
+            elapsed = time.monotonic() - self._continuous_since
+            return self._sweep_count_at_continuous + int(elapsed / self.sweep_time)
+        return self._sweep_count
+
+    def _get_reflection(self, freq: numpy.ndarray, sweepIndex: int):
+        resonance = RESONANCE_FREQ + RESONANCE_DRIFT * numpy.sin(2 * numpy.pi * sweepIndex / RESONANCE_DRIFT_SWEEPS)
+        detuning = freq / resonance - resonance / freq
+        return ((COUPLING - 1) - 1j * UNLOADED_Q * detuning) / ((COUPLING + 1) + 1j * UNLOADED_Q * detuning)
+
+    def _get_trace(self):
+        """
+        Returns the magnitude in dB of the last completed sweep and its frequency axis in Hz
+        """
+        state = self._state
+        sweep_index = self._get_sweep_index()
+        freq = numpy.linspace(state["start_freq"], state["stop_freq"], state["points"])
+        rng = numpy.random.default_rng((self.seed, sweep_index))
+        trace = 20 * numpy.log10(numpy.abs(self._get_reflection(freq, sweep_index)))
+        trace += rng.normal(0.0, NOISE_DB, size=trace.shape)
+        return trace, freq
+
+    def _get_binary_dtype(self):
+        # SWAPped is least significant byte first
+        return "<f4" if self._state["byte_order"] == "SWAP" else ">f4"
+
+    def _to_float_list(self, response):
+        if isinstance(response, bytes):
+            return numpy.frombuffer(response, dtype=self._get_binary_dtype()).tolist()
+        return [float(x) for x in response.split(",")]
+
+
+def open_instrument(resourceName: str, configVars: dict, reset: bool = True):
+    """
+    Opens a simulated instrument using the "SIM_" settings in the configuration
+    """
+    return SimulatedInstrument(resource_name=resourceName, id_query=True, reset=reset,
+                               sweepTime=configVars["SIM_SWEEP_TIME"],
+                               transferLatency=configVars["SIM_TRANSFER_LATENCY"],
+                               transferRate=configVars["SIM_TRANSFER_RATE"],
+                               seed=configVars["SIM_SEED"])